@@ -13,6 +13,10 @@ setup(
     license=open('LICENSE').read(),
     setup_requires=['pymongo>=3'],
     install_requires=['pymongo>=3'],
+    extras_require={'numpy': ['numpy']},
+    entry_points={
+        'console_scripts': ['yamo-import=yamo.importer:main'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
@@ -0,0 +1,40 @@
+import numpy
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import ValidationError
+
+
+class Q(Document):
+    _id = IntField()
+    v = ArrayField('float32', shape=(None, 3), min=0)
+
+
+Connection().register_all()
+
+
+def test_array():
+    Q.drop()
+    v = numpy.arange(12, dtype='float32').reshape(4, 3)
+    Q({'_id': 1, 'v': v}).save()
+    q = Q.query_one({'_id': 1})
+    assert q.v.dtype == numpy.float32
+    assert q.v.shape == (4, 3)
+    assert (q.v == v).all()
+
+
+def test_array_validation():
+    with assert_raises(ValidationError):
+        Q({'_id': 2, 'v': numpy.zeros((2, 2), dtype='float32')}).save()
+    with assert_raises(ValidationError):
+        Q({'_id': 2, 'v': -numpy.ones((2, 3), dtype='float32')}).save()
+    # float64 values would lose precision as float32
+    with assert_raises(ValidationError):
+        Q({'_id': 2, 'v': numpy.ones((2, 3))})
+    q = Q({'_id': 2, 'v': numpy.ones((2, 3), dtype='float16')})
+    assert q.v.dtype == numpy.float32
+
+
+if __name__ == '__main__':
+    test_array()
+    test_array_validation()
@@ -0,0 +1,83 @@
+import itertools
+from enum import Enum
+
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import BatchValidationError, ValidationError
+
+
+class Color(Enum):
+    red = 'red'
+
+
+class Bv(Document):
+    _id = IntField()
+    i = IntField(min=2, max=5)
+    ri = IntField(required=True, min=2, max=5)
+    rni = IntField(required=True, nullable=True, max=5)
+    s = StringField(min_length=2, max_length=4)
+    rs = StringField(required=True, max_length=4)
+    e = EmailField(required=True)
+    f = FloatField(required=True)
+    b = BooleanField()
+    c = EnumField(Color)
+    d = DateTimeField()
+
+
+Connection().register_all()
+
+VALUES = [None, 0, 1, 3, 9, -1, True, 2.5, '', 'ab', 'abcdef', 'a@b.c',
+          'x y@b.c', b'ab', [], {}, 'red', '2020-01-02']
+
+
+def failures_one_by_one(docs):
+    failures = []
+    for i, doc in enumerate(docs):
+        for name, field in Bv._fields.items():
+            if name not in doc._data:
+                continue
+            try:
+                field.validate(field.to_python(doc._data[name]))
+            except Exception:
+                failures.append((i, name, doc._data[name]))
+    return failures
+
+
+def test_same_as_validate():
+    docs = []
+    names = [n for n in Bv._fields if n != '_id']
+    for i, value in enumerate(VALUES):
+        docs.append(Bv())
+        for name in names:
+            docs[-1]._data[name] = value
+    # a few mixed documents
+    for values in itertools.islice(itertools.product(VALUES, repeat=3), 50):
+        doc = Bv()
+        for name, value in zip(names[::2], itertools.cycle(values)):
+            doc._data[name] = value
+        docs.append(doc)
+
+    expected = sorted(failures_one_by_one(docs), key=lambda f: f[:2])
+    with assert_raises(BatchValidationError) as cm:
+        Bv.validate_batch(docs)
+    assert sorted(cm.exception.failures, key=lambda f: f[:2]) == expected
+
+
+def test_bulk_upsert():
+    Bv.drop()
+    good = {'ri': 3, 'rni': None, 'rs': 'ab', 'e': 'a@b.c', 'f': 1.0}
+    docs = [Bv(dict(good, _id=1)), Bv(dict(good, _id=2, ri=7)),
+            Bv(dict(good, _id=3, e='nope'))]
+    with assert_raises(ValidationError) as cm:
+        Bv.bulk_upsert(docs)
+    assert cm.exception.failures == [(1, 'ri', 7), (2, 'e', 'nope')]
+    assert Bv.find_one() is None
+
+    Bv.bulk_upsert(docs[:1])
+    assert Bv.find_one({'_id': 1})['rs'] == 'ab'
+
+
+if __name__ == '__main__':
+    test_same_as_validate()
+    test_bulk_upsert()
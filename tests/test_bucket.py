@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import ConfigError
+
+
+class Reading(BucketDocument):
+    class Meta:
+        bucket = Bucket('sensor', 'ts', window=3600, size=3)
+    sensor = StringField()
+    ts = DateTimeField()
+    value = FloatField()
+
+
+Connection().register_all()
+
+
+def test_bucket_registered():
+    assert Reading in Connection.docdb
+    assert BucketDocument not in Connection.docdb
+
+
+def test_bucket():
+    Reading.drop()
+    t0 = datetime(2015, 1, 1)
+    readings = [Reading({'sensor': 's{}'.format(i % 2),
+                         'ts': t0 + timedelta(minutes=10 * i),
+                         'value': float(i)}) for i in range(12)]
+    Reading.append(*readings)
+    Reading({'sensor': 's0', 'ts': t0 + timedelta(minutes=5),
+             'value': -1.0}).save()
+
+    # 3 records per window and sensor, plus an overflow bucket for s0
+    assert len(list(Reading.find())) == 5
+    assert not list(Reading.find({'n': {'$gt': 3}}))
+
+    s0 = list(Reading.query_records({'sensor': 's0'}))
+    assert [r.value for r in s0] == [0.0, -1.0, 2.0, 4.0, 6.0, 8.0, 10.0]
+    assert all(r.sensor == 's0' for r in s0)
+
+    some = list(Reading.query_records(start=t0 + timedelta(minutes=20),
+                                      end=t0 + timedelta(minutes=70)))
+    assert sorted(r.value for r in some) == [2.0, 3.0, 4.0, 5.0, 6.0]
+
+
+def test_bucket_methods():
+    Reading.drop()
+    t0 = datetime(2015, 1, 1)
+    readings = [Reading({'sensor': 's0', 'ts': t0 + timedelta(minutes=i),
+                         'value': float(i)}) for i in range(4)]
+    assert Reading.bulk_upsert(readings, timeout=5) == 4
+    Reading({'sensor': 's1', 'ts': t0, 'value': 9.0}).upsert(timeout=5)
+    # no flat record next to the buckets
+    assert all('records' in doc for doc in Reading.find())
+    assert len(list(Reading.query_records())) == 5
+
+    assert Reading.query_one({'sensor': 's1'}).value == 9.0
+    assert Reading.query_one({'sensor': 's2'}) is None
+    later = Reading.query({'sensor': 's0'}, start=t0 + timedelta(minutes=2))
+    assert [r.value for r in later] == [2.0, 3.0]
+
+    with assert_raises(ConfigError):
+        Reading.get_many([1])
+    with assert_raises(ConfigError):
+        readings[0].remove()
+    with assert_raises(ConfigError):
+        readings[0].update({'$set': {'value': 0.0}})
+    with assert_raises(ConfigError):
+        Reading.writer()
+
+
+if __name__ == '__main__':
+    test_bucket_registered()
+    test_bucket()
+    test_bucket_methods()
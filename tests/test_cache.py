@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.cache import MemoryBackend, SQLiteBackend
+from yamo.errors import ConfigError
+
+
+class Q(Document):
+    _id = IntField()
+    a = IntField()
+
+
+Connection().register_all()
+
+
+def check_backend(backend):
+    Q.drop()
+    Q({'_id': 1, 'a': 1}).save()
+    assert Q.cached(60, backend=backend).query_one({'_id': 1}).a == 1
+    Q({'_id': 1, 'a': 2}).save()
+    q = Q.cached(60, backend=backend).query_one({'_id': 1})
+    assert isinstance(q, Q)
+    assert q.a == 1
+    assert Q.cached(0, backend=backend).query_one({'_id': 1}).a == 2
+
+    assert Q.cached(60, backend=backend).query_one({'_id': 2}) is None
+    Q({'_id': 2, 'a': 2}).save()
+    assert Q.cached(60, backend=backend).query_one({'_id': 2}).a == 2
+
+    qs = Q.cached(60, cache_none=True, backend=backend).query({'a': 2})
+    assert [q._id for q in qs] == [1, 2]
+
+
+def test_memory_backend():
+    backend = MemoryBackend()
+    check_backend(backend)
+    # values are kept as they are, not serialized
+    cached = Q.cached(60, backend=backend)
+    assert cached.query_one({'_id': 2}) is cached.query_one({'_id': 2})
+
+
+def test_sqlite_backend():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+    check_backend(SQLiteBackend(path))
+    # a second handle on the same file sees the warm cache
+    Q({'_id': 1, 'a': 3}).save()
+    q = Q.cached(60, backend=SQLiteBackend(path)).query_one({'_id': 1})
+    assert q.a == 2
+
+
+def test_sqlite_private_file():
+    backend = SQLiteBackend()
+    backend.set('ns', b'k', 1.0, b'v')
+    assert backend.get('ns', b'k') == (1.0, b'v')
+    assert os.stat(backend.path).st_mode & 0o077 == 0
+
+    # a file anyone could have written is refused
+    path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+    open(path, 'w').close()
+    os.chmod(path, 0o666)
+    with assert_raises(ConfigError):
+        SQLiteBackend(path).get('ns', b'k')
+
+
+if __name__ == '__main__':
+    test_memory_backend()
+    test_sqlite_backend()
+    test_sqlite_private_file()
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import numpy
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import ArgumentError
+
+
+class Q(Document):
+    _id = IntField()
+    n = IntField()
+    f = FloatField()
+    ok = BooleanField()
+    t = DateTimeField()
+    s = StringField()
+
+
+Connection().register_all()
+
+
+def test_query_columns():
+    Q.drop()
+    for i in range(10):
+        Q({'_id': i, 'n': i, 'f': i / 2, 'ok': i % 2 == 0,
+           't': datetime(2015, 1, i + 1), 's': str(i)}).save()
+    Q({'_id': 10, 's': 'x'}).save()
+
+    cols = Q.query_columns({'_id': {'$lt': 10}}, sort=[('_id', 1)])
+    assert list(cols) == list(Q._fields)
+    assert cols['n'].dtype == numpy.int64
+    assert cols['n'].sum() == 45
+    assert cols['f'].dtype == numpy.float64
+    assert cols['ok'].dtype == numpy.bool_
+    assert cols['t'][0] == numpy.datetime64('2015-01-01')
+    assert cols['s'] == [str(i) for i in range(10)]
+
+    cols = Q.query_columns(fields=['n', 's'], sort=[('_id', 1)])
+    assert list(cols) == ['n', 's']
+    assert numpy.isnan(cols['n'][10])
+
+    with assert_raises(ArgumentError):
+        Q.query_columns(fields=['n', 'missing'])
+
+
+if __name__ == '__main__':
+    test_query_columns()
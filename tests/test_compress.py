@@ -0,0 +1,98 @@
+import pickle
+
+from bson import Binary
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import ValidationError
+
+
+class Q(Document):
+    _id = IntField()
+    d = DictField(compress='zlib', compress_threshold=64)
+    l = ListField(IntField, compress='lzma', compress_threshold=64)
+    b = BinaryField(compress='zlib')
+    s = DictField(compress='zlib')
+
+
+class QV(Document):
+    _id = IntField()
+    b = BinaryField(compress='zlib', max_bytes=2048)
+
+
+Connection().register_all()
+
+
+def test_compress():
+    Q.drop()
+    d = {'k.{}'.format(i): 'v' * 10 for i in range(20)}
+    l = list(range(100))
+    b = b'x' * 4096
+    Q({'_id': 1, 'd': d, 'l': l, 'b': b, 's': {'a': 1}}).save()
+
+    raw = Q.find_one({'_id': 1})
+    assert isinstance(raw['d'], Binary)
+    assert isinstance(raw['l'], Binary)
+    assert len(raw['b']) < len(b)
+    assert raw['s'] == {'a': 1}
+
+    q = Q.query_one({'_id': 1})
+    assert q.d == d
+    assert q.l == l
+    assert q.b == b
+    assert q.s == {'a': 1}
+
+
+def test_validate_compressed():
+    QV.drop()
+    field = QV._fields['b']
+
+    def fail(value):
+        raise AssertionError('decompressed')
+    field._decompress = fail
+    try:
+        QV({'_id': 1, 'b': b'x' * 2048}).save()
+        QV.bulk_upsert([QV({'_id': 2, 'b': b'y' * 2048})])
+        with assert_raises(ValidationError):
+            QV({'_id': 3, 'b': b'x' * 4096}).save()
+        with assert_raises(ValidationError):
+            QV.bulk_upsert([QV({'_id': 3, 'b': b'x' * 4096})])
+    finally:
+        del field._decompress
+    assert QV.query_one({'_id': 2}).b == b'y' * 2048
+
+
+def test_invalid_not_compressed():
+    q = QV({'_id': 4, 'b': b'x' * 4096})
+    assert q._data['b'] == b'x' * 4096
+    # still invalid after a round trip through BSON
+    with assert_raises(ValidationError):
+        pickle.loads(pickle.dumps(q)).save()
+
+
+def test_decoded_cache():
+    Q.drop()
+    d = {'k{}'.format(i): 'v' * 10 for i in range(20)}
+    Q({'_id': 1, 'd': d}).save()
+    q = Q.query_one({'_id': 1})
+    field = Q._fields['d']
+    calls = []
+    decompress = field._decompress
+
+    def counted(value):
+        calls.append(1)
+        return decompress(value)
+    field._decompress = counted
+    try:
+        assert q.d == d
+        assert q.d == d
+    finally:
+        del field._decompress
+    assert len(calls) == 1
+
+
+if __name__ == '__main__':
+    test_compress()
+    test_validate_compressed()
+    test_invalid_not_compressed()
+    test_decoded_cache()
@@ -0,0 +1,39 @@
+import os
+
+from yamo import *
+
+
+class Q(Document):
+    _id = IntField()
+
+
+conn = Connection()
+conn.register_all()
+
+
+def test_pool_stats():
+    Q.drop()
+    Q({'_id': 1}).save()
+    stats = conn.pool_stats()
+    assert stats['created'] >= 1
+    assert stats['checkouts'] >= 1
+
+
+def test_rebuild_after_fork():
+    Q.drop()
+    Q({'_id': 1}).save()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            client = conn.client
+            ok = Q.query_one({'_id': 1}) is not None and \
+                conn.client is not client
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+
+
+if __name__ == '__main__':
+    test_pool_stats()
+    test_rebuild_after_fork()
@@ -0,0 +1,75 @@
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo import deadlines, metrics
+from yamo.errors import DeadlineExceeded
+
+
+class DL(Document):
+    _id = IntField()
+    a = IntField()
+
+
+Connection().register_all()
+
+
+def setup_module():
+    DL.drop()
+    DL.insert_many([{'_id': i, 'a': i} for i in range(10)])
+
+
+def test_nested():
+    assert deadlines.remaining() is None
+    with deadline(10):
+        with deadline(60):
+            assert deadlines.remaining() <= 10
+        with deadline(1):
+            assert deadlines.remaining() <= 1
+        assert 1 < deadlines.remaining() <= 10
+    assert deadlines.remaining() is None
+
+
+def test_find_kwargs():
+    assert deadlines.find_kwargs(DL, {'limit': 1}) == {'limit': 1}
+    with deadline(10):
+        kwargs = deadlines.find_kwargs(DL, {'limit': 1})
+        assert 9000 < kwargs['max_time_ms'] <= 10000
+        kwargs = deadlines.find_kwargs(DL, {'max_time_ms': 5})
+        assert kwargs['max_time_ms'] == 5
+
+
+def test_expired():
+    key = ('deadline_exceeded', 'DL')
+    before = metrics.counters[key]
+    with deadline(0):
+        with assert_raises(DeadlineExceeded):
+            DL.query_one({'_id': 1})
+        with assert_raises(DeadlineExceeded):
+            DL({'_id': 20, 'a': 20}).save()
+        with assert_raises(DeadlineExceeded):
+            DL.bulk_upsert([DL({'_id': 21, 'a': 21})])
+    assert metrics.counters[key] == before + 3
+    assert DL.query_one({'_id': 20}) is None
+
+    with assert_raises(DeadlineExceeded):
+        DL.query({}, timeout=0)
+    with assert_raises(DeadlineExceeded):
+        DL.get_many([1, 2], timeout=0)
+
+
+def test_timeout():
+    assert DL.query_one({'_id': 1}, timeout=5).a == 1
+    assert len(list(DL.query({}, timeout=5))) == 10
+    doc = DL.query_one({'_id': 2})
+    doc.a = -2
+    doc.save(timeout=5)
+    assert DL.query_one({'_id': 2}).a == -2
+    assert deadlines.remaining() is None
+
+
+if __name__ == '__main__':
+    setup_module()
+    test_nested()
+    test_find_kwargs()
+    test_expired()
+    test_timeout()
@@ -0,0 +1,50 @@
+from yamo import *
+from yamo import explain
+
+
+class X(Document):
+    class Meta:
+        idx1 = Index(['a', 'ts'])
+        idx2 = Index('b')
+        idx3 = Index('c', unique=True)
+    a = StringField()
+    b = StringField()
+    c = StringField()
+    ts = IntField()
+
+
+Connection().register_all()
+
+
+def test_filter_shape():
+    shape = explain.filter_shape({'a': 1, 'ts': {'$gt': 2},
+                                  '$and': [{'b': {'$in': [1, 2]}}]})
+    assert shape == (('a', 'b'), ('ts',))
+    assert explain.suggest_index((('a',), (('d', -1),), ('ts',))) == \
+        [('a', 1), ('d', -1), ('ts', 1)]
+
+
+def test_report():
+    X.drop()
+    X.prepare()
+    X({'a': 'x', 'b': 'y', 'c': 'z', 'ts': 1}).save()
+
+    recorder = explain.start()
+    try:
+        list(X.query({'a': 'x', 'ts': {'$gt': 0}}))
+        list(X.query({'a': 'y', 'ts': {'$gt': 0}}))
+        X.query_one({'d': 1})
+        X.query_one({'d': 2})
+    finally:
+        assert explain.stop() is recorder
+
+    report = recorder.report()['X']
+    assert report['queries'] == 4
+    assert report['uncovered'] == [
+        {'filter': (('d',), (), ()), 'count': 2, 'suggest': [('d', 1)]}]
+    assert report['unused'] == [[('b', 1)]]
+
+
+if __name__ == '__main__':
+    test_filter_shape()
+    test_report()
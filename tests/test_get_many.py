@@ -0,0 +1,48 @@
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.cache import MemoryBackend
+from yamo.errors import DocumentNotFound
+
+
+class G(Document):
+    _id = IntField()
+    a = IntField()
+
+
+Connection().register_all()
+
+
+def setup_module():
+    G.drop()
+    G.insert_many([{'_id': i, 'a': i} for i in range(100)])
+
+
+def test_get_many():
+    docs = G.get_many([5, 3, 200, 5, 99], chunk_size=2)
+    assert [d._id for d in docs] == [5, 3, 5, 99]
+    assert all(isinstance(d, G) for d in docs)
+    docs = G.get_many([5, 200], missing='none')
+    assert docs[0]._id == 5 and docs[1] is None
+    with assert_raises(DocumentNotFound):
+        G.get_many([5, 200, 201], missing='raise')
+    assert G.get_many([]) == []
+
+
+def test_cached_get_many():
+    backend = MemoryBackend()
+    assert G.cached(60, backend=backend).query_one({'_id': 1}).a == 1
+    G.update_one({'_id': 1}, {'$set': {'a': -1}})
+    G.update_one({'_id': 2}, {'$set': {'a': -2}})
+
+    docs = G.cached(60, backend=backend).get_many([2, 1])
+    # 1 is served from the query_one entry, 2 is fetched
+    assert [d.a for d in docs] == [-2, 1]
+    G.update_one({'_id': 2}, {'$set': {'a': 2}})
+    assert G.cached(60, backend=backend).query_one({'_id': 2}).a == -2
+
+
+if __name__ == '__main__':
+    setup_module()
+    test_get_many()
+    test_cached_get_many()
@@ -1,4 +1,7 @@
+from nose.tools import assert_raises
+
 from yamo import *
+from yamo.errors import ArgumentError
 
 
 class Q(Document):
@@ -8,6 +11,16 @@ class Q(Document):
     int1 = IntField(min=2, max=5, default=3)
 
 
+class F(Document):
+    class Meta:
+        idf = IDFormatter('{user}_{day}')
+        insert_first = True
+    user = StringField()
+    day = StringField()
+    n = IntField(default=0)
+    v = IntField()
+
+
 Connection().register_all()
 
 
@@ -20,5 +33,32 @@ def test_idformatter():
     assert q._id == '3'
 
 
+def test_template_fields():
+    assert IDFormatter('{a}_{b.c}-{d[0]}{{x}}{a}').fields == ('a', 'b', 'd')
+    assert IDFormatter(lambda **kw: 1).fields is None
+    with assert_raises(ArgumentError):
+        IDFormatter('{}_{0}')
+    assert F.Meta.idf.format_id({'user': 'u'}) is None
+    assert F.Meta.idf.format_id({'user': 'u', 'day': 'd'}) == 'u_d'
+
+
+def test_insert_first():
+    F.drop()
+    F({'user': 'u', 'day': '1', 'v': 1}).upsert()
+    F({'user': 'u', 'day': '1', 'v': 2}).upsert()
+    assert F.find_one({'_id': 'u_1'}) == \
+        {'_id': 'u_1', 'user': 'u', 'day': '1', 'n': 0, 'v': 2}
+
+    F.update_one({'_id': 'u_1'}, {'$set': {'n': 5}})
+    docs = [F({'user': 'u', 'day': str(i), 'v': 3}) for i in range(4)]
+    assert F.bulk_upsert(docs) == 3
+    assert F.find_one({'_id': 'u_1'})['v'] == 3
+    # defaults are only set on insert
+    assert F.find_one({'_id': 'u_1'})['n'] == 5
+    assert len(list(F.find())) == 4
+
+
 if __name__ == '__main__':
     test_idformatter()
+    test_template_fields()
+    test_insert_first()
@@ -0,0 +1,88 @@
+import io
+
+from yamo import *
+from yamo.errors import ValidationError
+
+
+class Q(Document):
+    class Meta:
+        idx1 = Index('name', unique=True)
+    name = StringField(required=True)
+    age = IntField(min=1, max=200)
+    vip = BooleanField()
+
+
+class QM(Document):
+    name = StringField(required=True)
+    updated = DateTimeField(modified=True, required=True)
+
+
+class QD(Document):
+    name = StringField()
+    n = IntField(default=7)
+
+
+Connection().register_all()
+
+
+def test_import_jsonl():
+    Q.drop()
+    lines = ['{"name": "a", "age": 3}\n',
+             '{"name": "b", "age": 300}\n',
+             'not json\n',
+             '\n',
+             '{"name": "c", "age": 5, "vip": true}\n']
+    r = Q.import_stream(lines, workers=2, chunk_size=2)
+    assert r.accepted == 2
+    assert r.written == 2
+    assert sorted(lineno for lineno, _, _ in r.rejected) == [2, 3]
+    assert isinstance(dict((x[0], x[2]) for x in r.rejected)[2],
+                      ValidationError)
+    assert Q.query_one({'name': 'c'}).vip is True
+
+
+def test_import_csv():
+    Q.drop()
+    source = io.StringIO('name,age,vip\na,3,yes\nb,,no\n')
+    r = Q.import_stream(source, format='csv', workers=0)
+    assert r.written == 2
+    assert r.rejected == []
+    assert Q.query_one({'name': 'a'}).age == 3
+    assert Q.query_one({'name': 'a'}).vip is True
+    assert Q.query_one({'name': 'b'}).age is None
+
+
+def test_import_pre_save():
+    # pre_save values are set before validation, as in save()
+    QM.drop()
+    r = QM.import_stream(['{"name": "a"}\n'], workers=0)
+    assert r.rejected == []
+    assert r.written == 1
+    assert QM.query_one({'name': 'a'}).updated is not None
+
+
+def test_import_insert_duplicates():
+    Q.drop()
+    Q.ensure_indexes()
+    lines = ['{{"name": "{}"}}\n'.format(n) for n in 'abcadb']
+    rejected = []
+    r = Q.import_stream(lines, mode='insert', workers=0, chunk_size=4,
+                        on_reject=lambda *reject: rejected.append(reject))
+    assert r.written == 4
+    assert [lineno for lineno, _, _ in rejected] == [4, 6]
+
+
+def test_import_empty_row():
+    QD.drop()
+    r = QD.import_stream(['{}\n', '{"name": "a"}\n'], mode='insert',
+                         workers=0)
+    assert r.written == 2
+    assert [q.n for q in QD.query({})] == [7, 7]
+
+
+if __name__ == '__main__':
+    test_import_jsonl()
+    test_import_csv()
+    test_import_pre_save()
+    test_import_insert_duplicates()
+    test_import_empty_row()
@@ -0,0 +1,42 @@
+import sys
+import subprocess
+
+# import time budget of `import yamo` plus a model declaration, in seconds
+BUDGET = 0.25
+
+CODE = '''
+import sys
+import time
+import threading
+
+start = time.perf_counter()
+import yamo
+
+
+class Q(yamo.Document):
+    class Meta:
+        idx1 = yamo.Index('a', unique=True)
+    a = yamo.IntField()
+    o = yamo.ObjectIdField()
+
+
+print(time.perf_counter() - start)
+print(threading.active_count())
+print(sorted(m for m in sys.modules
+             if m.split('.')[0] in ('pymongo', 'bson', 'numpy')))
+yamo.Connection().register_all()
+print('pymongo' in sys.modules)
+'''
+
+
+def test_lazy_import():
+    out = subprocess.check_output([sys.executable, '-c', CODE])
+    elapsed, threads, drivers, loaded = out.decode().splitlines()
+    assert float(elapsed) < BUDGET
+    assert threads == '1'
+    assert drivers == '[]'
+    assert loaded == 'True'
+
+
+if __name__ == '__main__':
+    test_lazy_import()
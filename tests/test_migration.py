@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from yamo import *
+from yamo.migration import Migration
+from yamo.unitofwork import diff
+
+
+class Mg(Document):
+    _id = IntField()
+    created = DateTimeField()
+    text = StringField()
+
+
+Connection().register_all()
+
+migration = Migration('test_migration')
+
+
+@migration.transform(Mg, {'created': {'$type': 'string'}})
+def parse_created(data):
+    data['created'] = Mg._fields['created'].to_python(data['created'])
+
+
+@migration.transform(Mg)
+def rename_body(data):
+    if 'body' in data:
+        data = dict(data)
+        data['text'] = data.pop('body')
+        return data
+
+
+def test_migration():
+    Mg.drop()
+    Mg._db.yamo_migrations.delete_many({})
+    Mg.insert_many([{'_id': i, 'created': '2020-01-02', 'body': str(i)}
+                    for i in range(200)] +
+                   [{'_id': 200, 'created': datetime(2021, 1, 1),
+                     'text': 'x'}])
+    assert migration.run(workers=2, batch_size=30) == [200, 201]
+    assert Mg.find_one({'_id': 3}) == {
+        '_id': 3, 'created': datetime(2020, 1, 2), 'text': '3'}
+    assert Mg.query_one({'_id': 200}).text == 'x'
+    assert migration.is_done()
+    assert migration.run() == []
+
+
+def test_type_change():
+    assert diff({'f': 1}, {'f': 1.0}) == {'$set': {'f': 1.0}}
+    assert diff({'f': True}, {'f': 1}) == {'$set': {'f': 1}}
+    assert diff({'f': {'g': [1]}}, {'f': {'g': [1.0]}}) == \
+        {'$set': {'f': {'g': [1.0]}}}
+    assert diff({'f': {'g': [1]}}, {'f': {'g': [1]}}) == {}
+
+    to_float = Migration('test_type_change')
+
+    @to_float.transform(Mg, {'n': {'$type': 'int'}})
+    def int_to_float(data):
+        data['n'] = float(data['n'])
+
+    Mg.drop()
+    Mg._db.yamo_migrations.delete_many({})
+    Mg.insert_many([{'_id': i, 'n': i} for i in range(10)])
+    to_float.run(workers=1)
+    assert all(isinstance(d['n'], float) for d in Mg.find())
+
+
+if __name__ == '__main__':
+    test_migration()
+    test_type_change()
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime
+
+from yamo import *
+from yamo.mirror import Mirror
+
+
+class Country(Document):
+    class Meta:
+        idx1 = Index('code', unique=True)
+    code = StringField()
+    name = StringField()
+
+
+class Setting(Document):
+    key = StringField()
+    value = IntField()
+    modified_at = DateTimeField(modified=True)
+
+
+Connection().register_all()
+
+
+def test_mirror():
+    Country.drop()
+    Country({'code': 'CN', 'name': 'China'}).save()
+    Country({'code': 'FR', 'name': 'France'}).save()
+    mirror = Country.mirror()
+    try:
+        assert Country.mirror() is mirror
+        c = Country.query_one({'code': 'CN'})
+        assert c.name == 'China'
+        assert Country.query_one({'_id': c._id}).code == 'CN'
+        assert Country.query_one({'name': 'France'}).code == 'FR'
+        assert Country.query_one({'code': 'XX'}) is None
+
+        c.name = 'changed'
+        assert Country.query_one({'code': 'CN'}).name == 'China'
+    finally:
+        mirror.stop()
+
+
+def test_match_types():
+    assert Mirror._match({'a': 1}, {'a': 1.0})
+    assert not Mirror._match({'a': 1}, {'a': True})
+    assert not Mirror._match({'a': [0, 1]}, {'a': True})
+    assert Mirror._match({'a': [0, True]}, {'a': True})
+
+
+def test_poll_without_modified_values():
+    Setting.drop()
+    Setting._coll.insert_one({'key': 'a', 'value': 1})
+    mirror = Mirror(Setting, poll_interval=0.01).start()
+    try:
+        Setting._coll.insert_one({'key': 'b', 'value': 2,
+                                  'modified_at': datetime.utcnow()})
+        for _ in range(100):
+            if any(d['key'] == 'b' for d in mirror.docs.values()):
+                break
+            time.sleep(0.01)
+        assert sorted(d['key'] for d in mirror.docs.values()) == ['a', 'b']
+    finally:
+        mirror.stop()
+
+
+if __name__ == '__main__':
+    test_mirror()
+    test_match_types()
+    test_poll_without_modified_values()
@@ -0,0 +1,90 @@
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import ConfigError
+from yamo.pagination import decode_token
+
+
+class Q(Document):
+    class Meta:
+        idx1 = Index([('score', -1), ('name', 1), ('_id', 1)])
+    name = StringField()
+    score = IntField()
+
+
+class Q2(Document):
+    class Meta:
+        idx1 = Index([('score', -1), ('name', 1)])
+        idx2 = Index('code', unique=True)
+    name = StringField()
+    score = IntField()
+    code = StringField()
+
+
+Connection().register_all()
+
+
+def test_paginate():
+    Q.drop()
+    for i in range(25):
+        Q({'name': 'n{:02d}'.format(i), 'score': i % 5}).save()
+
+    seen = []
+    token = None
+    while True:
+        page = next(Q.paginate(order_by=[('score', -1), 'name'],
+                               page_size=10, token=token))
+        seen.extend(q.name for q in page)
+        token = page.token
+        if token is None:
+            break
+    assert len(seen) == 25
+    assert len(set(seen)) == 25
+    assert seen[0] == 'n04'
+
+    pages = list(Q.paginate({'score': 1},
+                            order_by=[('score', -1), 'name'], page_size=2))
+    assert [len(p) for p in pages] == [2, 2, 1]
+
+
+def test_paginate_requires_index():
+    with assert_raises(ConfigError):
+        next(Q.paginate(order_by=['name']))
+    # without _id, the index can't provide the sort
+    with assert_raises(ConfigError):
+        next(Q2.paginate(order_by=[('score', -1), 'name']))
+    assert list(Q2.paginate(order_by=['code'])) == [[]]
+
+
+def test_paginate_nulls():
+    Q.drop()
+    for i in range(12):
+        Q({'name': 'm{:02d}'.format(i),
+           'score': i % 3 if i % 4 else None}).save()
+    for order_by in ([('score', -1), 'name'],
+                     [('score', 1), ('name', -1), ('_id', -1)]):
+        seen = []
+        for page in Q.paginate(order_by=order_by, page_size=4):
+            seen.extend(q.name for q in page)
+        assert len(seen) == 12
+        assert len(set(seen)) == 12
+
+
+def test_paginate_unique():
+    Q2.drop()
+    for i in range(5):
+        Q2({'code': 'c{}'.format(i), 'score': i}).save()
+    page = next(Q2.paginate(order_by=['code'], page_size=2))
+    assert [q.code for q in page] == ['c0', 'c1']
+    # the unique key orders the documents, no _id in the token
+    assert decode_token([('code', 1)], page.token) == ['c1']
+    page = next(Q2.paginate(order_by=['code'], page_size=2,
+                            token=page.token))
+    assert [q.code for q in page] == ['c2', 'c3']
+
+
+if __name__ == '__main__':
+    test_paginate()
+    test_paginate_requires_index()
+    test_paginate_nulls()
+    test_paginate_unique()
@@ -0,0 +1,100 @@
+from bson import ObjectId, Code, DBRef
+
+from yamo import *
+from yamo.pagination import type_group
+from yamo.parallel import Checkpoint
+
+
+class Pq(Document):
+    _id = IntField()
+    n = IntField()
+
+
+class Mixed(Document):
+    _id = AnyField()
+
+
+class MixedK(Document):
+    class Meta:
+        shardkey = ShardKey([('k', 1)])
+    _id = IntField()
+    k = AnyField()
+
+
+Connection().register_all()
+
+
+def setup_module():
+    Pq.drop()
+    Pq.insert_many([{'_id': i, 'n': i % 3} for i in range(1000)])
+
+
+def test_merged():
+    docs = list(Pq.parallel_query({'n': 1}, workers=3, batch_size=50))
+    assert all(isinstance(d, Pq) for d in docs)
+    assert sorted(d._id for d in docs) == list(range(1, 1000, 3))
+
+    docs = list(Pq.parallel_query(workers=2, executor='process',
+                                  batch_size=100))
+    assert sorted(d._id for d in docs) == list(range(1000))
+
+
+def test_mixed_types():
+    # split points are ints, other keys go to a partition of their own
+    Mixed.drop()
+    ids = list(range(200)) + ['s{}'.format(i) for i in range(30)] + \
+        [ObjectId() for _ in range(10)]
+    Mixed.insert_many([{'_id': i} for i in ids])
+    docs = list(Mixed.parallel_query(workers=2, partitions=4,
+                                     batch_size=7))
+    assert len(docs) == len(ids)
+    assert set(d._id for d in docs) == set(ids)
+
+
+def test_unlisted_types():
+    assert type_group('s') == 3
+    assert type_group(Code('f()')) is None
+    assert type_group(DBRef('c', 1)) is None
+    # keys of unlisted types go to the untyped partition
+    MixedK.drop()
+    keys = list(range(50)) + [Code('f{}()'.format(i)) for i in range(5)]
+    MixedK.insert_many([{'_id': i, 'k': k} for i, k in enumerate(keys)])
+    docs = list(MixedK.parallel_query(workers=2, partitions=3,
+                                      batch_size=4))
+    assert sorted(d._id for d in docs) == list(range(len(keys)))
+
+
+def test_checkpoint():
+    checkpoint = Checkpoint('test_parallel')
+    checkpoint.bind(Pq).clear()
+
+    seen = []
+    scan = Pq.parallel_query(workers=2, partitions=4, batch_size=100,
+                             checkpoint=checkpoint)
+    for doc in scan:
+        seen.append(doc._id)
+        if len(seen) == 300:
+            break
+    scan.close()
+
+    parts = checkpoint.load()
+    # 4 ranges, and the partition of keys of other types
+    assert len(parts) == 5
+    assert not all(p['done'] for p in parts)
+
+    count = Pq.parallel_query(workers=2, batch_size=100,
+                              checkpoint=checkpoint,
+                              callback=lambda docs: seen.extend(
+                                  d._id for d in docs))
+    assert count == 1000
+    assert set(seen) == set(range(1000))
+    assert all(p['done'] for p in checkpoint.load())
+    checkpoint.clear()
+
+
+if __name__ == '__main__':
+    setup_module()
+    test_merged()
+    test_mixed_types()
+    test_unlisted_types()
+    test_checkpoint()
@@ -0,0 +1,86 @@
+import pickle
+
+from yamo import *
+from yamo.packing import pack, unpack
+
+
+class Inner(EmbeddedDocument):
+    x = IntField()
+
+
+class Pk(Document):
+    _id = IntField()
+    name = StringField()
+    inner = EmbeddedField(Inner)
+    n = IntField(default=5)
+    d = DictField()
+
+
+Connection().register_all()
+
+
+def test_pickle():
+    p = Pk({'_id': 1, 'name': 'a', 'inner': {'x': 2}})
+    assert p.inner.x == 2
+    q = pickle.loads(pickle.dumps(p))
+    assert isinstance(q, Pk)
+    assert q._data == p._data
+    assert q._defaults == p._defaults
+    assert q.inner.x == 2
+
+    i = pickle.loads(pickle.dumps(Inner({'x': 3})))
+    assert isinstance(i, Inner)
+    assert i.x == 3
+
+    # not BSON encodable
+    p.d = {1: 'one'}
+    assert pickle.loads(pickle.dumps(p)).d == {1: 'one'}
+    p.d = {}
+    p.n = 2 ** 70
+    assert pickle.loads(pickle.dumps(p)).n == 2 ** 70
+
+
+def test_pickle_changed():
+    # new Documents stay new, loaded ones keep their changed fields
+    new = Pk({'_id': 1, 'inner': {'x': 1}})
+    assert pickle.loads(pickle.dumps(new))._changed is None
+    Pk.drop()
+    Pk({'_id': 2, 'name': 'b', 'inner': {'x': 1}}).save()
+    p = Pk.query_one({'_id': 2})
+    assert pickle.loads(pickle.dumps(p))._changed == set()
+    p.name = 'c'
+    assert pickle.loads(pickle.dumps(p))._changed == {'name'}
+
+    # the pickled data wins over the instance of the session
+    with session():
+        s = Pk.query_one({'_id': 2})
+        q = pickle.loads(pickle.dumps(p))
+        assert q is not s
+        assert q.name == 'c' and s.name == 'b'
+
+
+def test_pack():
+    docs = [Pk({'_id': i, 'name': str(i), 'inner': {'x': i}})
+            for i in range(10)]
+    docs.append(Inner({'x': 10}))
+    unpacked = unpack(pack(docs))
+    assert [type(d) for d in unpacked] == [type(d) for d in docs]
+    assert [d._data for d in unpacked] == [d._data for d in docs]
+    assert unpack(pack([])) == []
+
+    # defaults and changed fields are kept, as by pickle
+    Pk.drop()
+    Pk({'_id': 1, 'name': 'a', 'inner': {'x': 1}}).save()
+    loaded = Pk.query_one({'_id': 1})
+    loaded.name = 'b'
+    new = Pk({'_id': 2, 'inner': {'x': 2}})
+    loaded2, new2 = unpack(pack([loaded, new]))
+    assert loaded2._changed == {'name'}
+    assert new2._changed is None
+    assert new2._defaults == new._defaults == {'n': 5, 'd': {}}
+
+
+if __name__ == '__main__':
+    test_pickle()
+    test_pickle_changed()
+    test_pack()
@@ -0,0 +1,67 @@
+import time
+import threading
+
+from yamo import *
+
+
+class PF(Document):
+    _id = IntField()
+    a = IntField()
+
+
+Connection().register_all()
+
+
+def setup_module():
+    PF.drop()
+    PF.insert_many([{'_id': i, 'a': i * 2} for i in range(50)])
+
+
+def prefetch_threads():
+    return [t for t in threading.enumerate() if t.name == 'yamo-prefetch']
+
+
+def test_prefetch():
+    plain = list(PF.query({'a': {'$gte': 10}}, sort=[('_id', 1)]))
+    docs = list(PF.query({'a': {'$gte': 10}}, sort=[('_id', 1)],
+                         batch_size=7, prefetch=2))
+    assert [d._id for d in docs] == [d._id for d in plain]
+    assert all(isinstance(d, PF) for d in docs)
+    assert docs[0].a == 10
+
+
+def test_memory_cap():
+    # one batch at a time when the cap is below the size of a batch
+    docs = list(PF.query({}, batch_size=5, prefetch=4, prefetch_bytes=1))
+    assert len(docs) == 50
+
+
+def test_prefetch_session():
+    # Documents are built in the session of the consumer
+    with session():
+        q = PF.query_one({'_id': 3})
+        docs = list(PF.query({}, sort=[('_id', 1)], batch_size=7,
+                             prefetch=2))
+        assert docs[3] is q
+        docs[4].a = -1
+    assert PF.query_one({'_id': 4}).a == -1
+    PF.update_one({'_id': 4}, {'$set': {'a': 8}})
+
+
+def test_early_close():
+    it = PF.query({}, batch_size=5, prefetch=2)
+    assert next(it)._id is not None
+    it.close()
+    for _ in range(50):
+        if not prefetch_threads():
+            break
+        time.sleep(0.01)
+    assert not prefetch_threads()
+
+
+if __name__ == '__main__':
+    setup_module()
+    test_prefetch()
+    test_memory_cap()
+    test_prefetch_session()
+    test_early_close()
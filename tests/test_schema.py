@@ -0,0 +1,127 @@
+from enum import Enum
+
+from nose.tools import assert_raises
+
+from pymongo.errors import WriteError
+
+from yamo import *
+from yamo.errors import ValidationError
+
+
+class Color(Enum):
+    red = 'red'
+    blue = 'blue'
+
+
+class Address(EmbeddedDocument):
+    city = StringField(required=True)
+
+
+class S(Document):
+    class Meta:
+        server_validation = True
+    _id = IntField()
+    name = StringField(required=True, min_length=2, max_length=8)
+    age = IntField(min=1, max=150)
+    email = EmailField()
+    color = EnumField(Color, required=True)
+    address = EmbeddedField(Address, required=True)
+    tags = ListField(StringField(required=True))
+    extra = DictField(required=True, compress='zlib')
+
+
+class Off(Document):
+    class Meta:
+        client_validation = 'off'
+    _id = IntField()
+    name = StringField(required=True, max_length=4)
+
+
+class Falsy(Document):
+    class Meta:
+        server_validation = True
+    _id = IntField()
+    name = StringField(min_length=2)
+    age = IntField(min=1)
+    email = EmailField()
+
+
+class Changed(Document):
+    class Meta:
+        client_validation = 'changed'
+        server_validation = False
+    _id = IntField()
+    name = StringField(required=True, max_length=4)
+    age = IntField(max=150)
+
+
+Connection().register_all()
+
+
+def test_json_schema():
+    schema = S.json_schema()
+    assert schema['required'] == ['address', 'color', 'extra', 'name']
+    props = schema['properties']
+    # like validate(), bounds are not checked on falsy values
+    assert props['name'] == {'bsonType': ['string'],
+                             'anyOf': [{'minLength': 2, 'maxLength': 8},
+                                       {'enum': ['']}]}
+    # types are only enforced for required fields, like validate()
+    assert props['age'] == {'anyOf': [{'minimum': 1, 'maximum': 150},
+                                      {'enum': [0]}]}
+    assert props['email']['anyOf'][0]['pattern'] == \
+        EmailField.email_re.pattern
+    assert props['email']['anyOf'][1] == {'enum': ['']}
+    Falsy({'_id': 1, 'name': '', 'age': 0, 'email': ''}).validate()
+    assert props['color'] == {'enum': ['red', 'blue']}
+    assert props['address']['required'] == ['city']
+    assert props['address']['properties']['city'] == {'bsonType': ['string']}
+    assert props['tags'] == {'items': {'bsonType': ['string']}}
+    assert props['extra'] == {'bsonType': ['object', 'binData']}
+
+
+def test_server_validation():
+    S.drop()
+    S.prepare()
+    validator = S.options()['validator']
+    assert validator == {'$jsonSchema': S.json_schema()}
+    with assert_raises(WriteError):
+        S.insert_one({'_id': 1, 'name': 'x'})
+
+    Off.drop()
+    Off.prepare()
+    with assert_raises(WriteError):
+        Off({'_id': 1, 'name': 'too long'}).save()
+    Off({'_id': 1, 'name': 'ok'}).save()
+
+    # falsy values skip the bounds on both sides
+    Falsy.drop()
+    Falsy.prepare()
+    Falsy({'_id': 1, 'name': '', 'age': 0, 'email': ''}).save()
+    with assert_raises(WriteError):
+        Falsy.insert_one({'_id': 2, 'name': 'x'})
+
+
+def test_client_validation():
+    Changed.drop()
+    # stored before a rule was tightened, for instance
+    Changed.insert_one({'_id': 1, 'name': 'too long', 'age': 1})
+
+    c = Changed.query_one({'_id': 1})
+    c.age = 2
+    c.save()
+    assert Changed.find_one({'_id': 1})['age'] == 2
+
+    c.age = 200
+    with assert_raises(ValidationError):
+        c.save()
+
+    # new documents are fully validated
+    with assert_raises(ValidationError):
+        Changed({'_id': 2, 'name': 'too long'}).save()
+
+
+if __name__ == '__main__':
+    test_json_schema()
+    test_server_validation()
+    test_client_validation()
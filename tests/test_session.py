@@ -0,0 +1,88 @@
+from yamo import *
+
+
+class Q(Document):
+    _id = IntField()
+    a = IntField(default=0)
+    b = StringField()
+
+
+class QU(Document):
+    class Meta:
+        idx1 = Index('code', unique=True)
+    code = StringField()
+    n = IntField()
+
+
+Connection().register_all()
+
+
+def test_identity_map():
+    Q.drop()
+    Q({'_id': 1, 'b': 'x'}).save()
+    with session():
+        q1 = Q.query_one({'_id': 1})
+        q2 = Q.query_one({'b': 'x'})
+        assert q1 is q2
+    assert Q.query_one({'_id': 1}) is not Q.query_one({'_id': 1})
+
+
+def test_unit_of_work():
+    Q.drop()
+    Q({'_id': 1, 'b': 'x'}).save()
+    with session() as s:
+        q = Q.query_one({'_id': 1})
+        q.b = 'y'
+        Q({'_id': 2, 'b': 'z'}).save()
+        Q({'_id': 3, 'a': 3}).upsert()
+        assert Q.query_one({'_id': 2}) is None
+        assert Q.query_one({'_id': 1}).b == 'y'
+    assert Q.query_one({'_id': 1}).b == 'y'
+    assert Q.query_one({'_id': 2}).b == 'z'
+    assert Q.query_one({'_id': 3}).a == 3
+
+    with session() as s:
+        Q.query_one({'_id': 2}).remove()
+        assert s.flush() == 1
+    assert Q.query_one({'_id': 2}) is None
+
+
+def test_discard_on_error():
+    Q.drop()
+    try:
+        with session():
+            Q({'_id': 1}).save()
+            raise ValueError
+    except ValueError:
+        pass
+    assert Q.query_one({'_id': 1}) is None
+
+
+def test_update_and_changes():
+    Q.drop()
+    Q({'_id': 1, 'b': 'x'}).save()
+    with session():
+        q = Q.query_one({'_id': 1})
+        q.b = 'y'
+        q.update({'$inc': {'a': 1}})
+    q = Q.query_one({'_id': 1})
+    assert (q.a, q.b) == (1, 'y')
+
+
+def test_upsert_existing():
+    QU.drop()
+    QU({'code': 'c', 'n': 1}).save()
+    _id = QU.query_one({'code': 'c'})._id
+    with session():
+        u = QU({'code': 'c', 'n': 2})
+        u.upsert()
+    assert u._id == _id
+    assert QU.query_one({'code': 'c'}).n == 2
+
+
+if __name__ == '__main__':
+    test_identity_map()
+    test_unit_of_work()
+    test_discard_on_error()
+    test_update_and_changes()
+    test_upsert_existing()
@@ -0,0 +1,66 @@
+from yamo import *
+from yamo import metrics
+
+
+class Sh(Document):
+    class Meta:
+        shardkey = ShardKey([('author', 1), ('tid', 1)])
+        idx1 = Index('slug', unique=True)
+    _id = IntField()
+    author = StringField()
+    tid = IntField()
+    slug = StringField()
+    text = StringField()
+
+
+Connection().register_all()
+
+
+def test_target_filter():
+    s = Sh({'_id': 1, 'author': 'a', 'tid': 2, 'slug': 's'})
+    assert s._target_filter() == {'_id': 1, 'author': 'a', 'tid': 2}
+    assert s._save_op()._filter == {'_id': 1, 'author': 'a', 'tid': 2}
+
+    s = Sh({'author': 'a', 'slug': 's'})
+    assert s._upsert_filter() == {'slug': 's', 'author': 'a'}
+
+
+def test_write_targeted():
+    Sh.drop()
+    s = Sh({'_id': 1, 'author': 'a', 'tid': 2, 'text': 'x'})
+    s.save()
+    s.update({'$set': {'text': 'y'}})
+    s.refresh()
+    assert s.text == 'y'
+    s.remove()
+    assert len(list(Sh.find())) == 0
+
+    docs = [Sh({'_id': i, 'author': 'b' if i % 2 else 'a', 'tid': i})
+            for i in range(6)]
+    assert [d._id for d in Sh._shard_order(docs)] == [0, 2, 4, 1, 3, 5]
+    Sh.bulk_upsert(docs)
+    assert len(list(Sh.find())) == 6
+
+
+def test_scatter_gather():
+    events = []
+
+    def hook(name, cls, info):
+        events.append((name, cls, info['filter']))
+
+    metrics.add_hook(hook)
+    try:
+        list(Sh.query({'author': 'a'}))
+        Sh.query_one({'author': {'$gt': 'a'}})
+        list(Sh.query({'text': 'x'}))
+        Sh.query_one(1)
+    finally:
+        metrics.remove_hook(hook)
+    assert events == [('scatter_gather', Sh, {'text': 'x'}),
+                      ('scatter_gather', Sh, {'_id': 1})]
+
+
+if __name__ == '__main__':
+    test_target_filter()
+    test_write_targeted()
+    test_scatter_gather()
@@ -15,6 +15,16 @@ class Q(Document):
     b = StringField()
 
 
+class R(Document):
+    class Meta:
+        idx1 = Index(['a', 'b'], unique=True)
+        idx2 = Index('c', unique=True)
+    a = StringField()
+    b = StringField()
+    c = StringField()
+    d = IntField()
+
+
 Connection().register_all()
 
 
@@ -45,6 +55,30 @@ def test_default_with_upsert():
     assert q.b == '4'
 
 
+def test_upsert_filter_plan():
+    assert R.Meta._unique_keys == [('c',), ('a', 'b')]
+    assert R.unique_fields == set(['a', 'b', 'c'])
+    assert R({'a': '1', 'c': '2'})._upsert_filter() == {'c': '2'}
+    assert R({'a': '1', 'b': '2'})._upsert_filter() == {'a': '1', 'b': '2'}
+    assert R({'a': '1', 'd': 2})._upsert_filter() == {}
+    r = R({'c': '2'})
+    r._id = 1
+    assert r._upsert_filter() == {'_id': 1}
+
+    R.drop()
+    r = R({'a': '1', 'b': '2', 'd': 1})
+    r.upsert()
+    r2 = R({'a': '1', 'b': '2', 'd': 2})
+    r2.upsert()
+    assert r2._id == r._id
+    assert R.query_one({'_id': r._id}).d == 2
+    r3 = R({'d': 3})
+    r3._id = r._id
+    r3.upsert()
+    assert R.query_one({'_id': r._id}).d == 3
+
+
 if __name__ == '__main__':
     test_upsert()
     test_default_with_upsert()
+    test_upsert_filter_plan()
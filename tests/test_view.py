@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from yamo import *
+
+
+class Order(Document):
+    _id = IntField()
+    shop = StringField()
+    amount = FloatField()
+    modified = DateTimeField(modified=True)
+
+
+class ShopSales(MaterializedView):
+    class Meta:
+        view = View(Order, [{'$group': {'_id': '$shop',
+                                        'total': {'$sum': '$amount'},
+                                        'n': {'$sum': 1}}}],
+                    partition_key='shop')
+    total = FloatField()
+    n = IntField()
+
+
+class BigOrder(MaterializedView):
+    class Meta:
+        view = View(Order, [{'$match': {'amount': {'$gte': 10}}},
+                            {'$project': {'shop': 1, 'amount': 1}}],
+                    lag=0)
+    shop = StringField()
+    amount = FloatField()
+
+
+Connection().register_all()
+
+
+def test_view():
+    Order.drop()
+    ShopSales.drop()
+    BigOrder.drop()
+    ShopSales._state().delete_many({})
+    assert not ShopSales.refresh_view()
+
+    Order({'_id': 1, 'shop': 'a', 'amount': 1.0}).save()
+    Order({'_id': 2, 'shop': 'b', 'amount': 10.0}).save()
+    assert ShopSales.refresh_view()
+    assert BigOrder.refresh_view()
+    assert ShopSales.query_one({'_id': 'a'}).total == 1.0
+    assert ShopSales.watermark() is not None
+    # the last lag seconds are merged again, with the same results
+    assert ShopSales.refresh_view()
+    assert ShopSales.query_one({'_id': 'a'}).total == 1.0
+
+    # committed after a refresh, with an older watermark value
+    Order.insert_one({'_id': 4, 'shop': 'c', 'amount': 5.0,
+                      'modified': ShopSales.watermark() -
+                      timedelta(seconds=1)})
+    assert ShopSales.refresh_view()
+    assert ShopSales.query_one({'_id': 'c'}).total == 5.0
+    Order.delete_one({'_id': 4})
+    ShopSales.delete_one({'_id': 'c'})
+
+    time.sleep(0.01)
+    Order({'_id': 3, 'shop': 'a', 'amount': 20.0}).save()
+    assert ShopSales.refresh_view()
+    assert BigOrder.refresh_view()
+    # shop a is recomputed over all its orders
+    a = ShopSales.query_one({'_id': 'a'})
+    assert (a.total, a.n) == (21.0, 2)
+    assert ShopSales.query_one({'_id': 'b'}).total == 10.0
+    assert sorted(o._id for o in BigOrder.query()) == [2, 3]
+    assert not BigOrder.refresh_view()
+
+    Order.delete_one({'_id': 2})
+    ShopSales.rebuild()
+    assert [s._id for s in ShopSales.query()] == ['a']
+
+
+if __name__ == '__main__':
+    test_view()
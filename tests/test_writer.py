@@ -0,0 +1,98 @@
+import time
+
+from nose.tools import assert_raises
+
+from yamo import *
+from yamo.errors import YamoException
+from yamo.writer import merge_updates
+
+
+class Q(Document):
+    _id = IntField()
+    a = IntField(default=0)
+    b = StringField()
+
+
+Connection().register_all()
+
+
+def test_merge_updates():
+    assert merge_updates({'$inc': {'a': 1}, '$set': {'b': 'x'}},
+                         {'$inc': {'a': 2}, '$set': {'b': 'y'}}) == \
+        {'$inc': {'a': 3}, '$set': {'b': 'y'}}
+    assert merge_updates({'$inc': {'a': 1}}, {'$set': {'a': 1}}) is None
+    assert merge_updates({'$push': {'a': 1}}, {'$set': {'b': 1}}) is None
+
+
+def test_writer():
+    Q.drop()
+    writer = Q.writer(max_batch=100, max_delay=0.1)
+    for i in range(10):
+        writer.save(Q({'_id': 1, 'b': str(i)}))
+        writer.update(2, {'$inc': {'a': 1}})
+    writer.update(2, {'$set': {'b': 'x'}})
+    assert writer.count == 2
+    time.sleep(0.5)
+    assert writer.count == 0
+    assert Q.query_one({'_id': 1}).b == '9'
+    q = Q.query_one({'_id': 2})
+    assert q is None
+
+    Q({'_id': 2}).save()
+    for i in range(5):
+        writer.update(2, {'$inc': {'a': 1}})
+    writer.close()
+    assert Q.query_one({'_id': 2}).a == 5
+
+
+def test_writer_order():
+    Q.drop()
+    writer = Q.writer(max_batch=100, max_delay=60)
+    writer.upsert(Q({'_id': 3, 'b': 'x'}))
+    writer.update(3, {'$inc': {'a': 1}})
+    # one document, so the update waits for the next round
+    assert len(writer.pending) == 1
+    writer.close()
+    assert Q.query_one({'_id': 3}).a == 1
+
+
+def test_writer_upserts():
+    Q.drop()
+    writer = Q.writer(max_batch=100, max_delay=60)
+    # null values are not upserted, the first upsert is kept
+    writer.upsert(Q({'_id': 4, 'b': 'x'}))
+    writer.upsert(Q({'_id': 4, 'a': 5}))
+    writer.close()
+    q = Q.query_one({'_id': 4})
+    assert (q.a, q.b) == (5, 'x')
+    with assert_raises(YamoException):
+        writer.save(Q({'_id': 5}))
+
+
+def test_writer_on_error():
+    Q.drop()
+    errors = []
+
+    def on_error(e, ops):
+        errors.append(e)
+        raise ValueError('callback failed')
+    writer = Q.writer(max_batch=100, max_delay=0.05, on_error=on_error)
+    Q({'_id': 6}).save()
+    # _id can't be changed
+    writer.update(6, {'$set': {'_id': 7}})
+    time.sleep(0.3)
+    assert len(errors) == 1
+    # the flush thread survived the callback
+    writer.save(Q({'_id': 6, 'b': 'y'}))
+    time.sleep(0.3)
+    assert writer.thread.is_alive()
+    assert Q.query_one({'_id': 6}).b == 'y'
+    writer.close()
+
+
+if __name__ == '__main__':
+    test_merge_updates()
+    test_writer()
+    test_writer_order()
+    test_writer_upserts()
+    test_writer_on_error()
@@ -3,14 +3,21 @@ from .document import Document, EmbeddedDocument
 from .fields import (ObjectIdField, IntField, BooleanField, FloatField,
                      BinaryField, StringField, EmailField, DateTimeField,
                      DictField, ListField, EmbeddedField, SequenceField,
-                     AnyField, EnumField)
-from .metatype import ShardKey, IDFormatter, Index
+                     AnyField, EnumField, ArrayField)
+from .metatype import ShardKey, IDFormatter, Index, Bucket, View
+from .bucket import BucketDocument
+from .view import MaterializedView
+from .unitofwork import Session, session
+from .deadlines import deadline
 
-__all__ = ['Connection', 'Document', 'EmbeddedDocument', 'AnyField',
+__all__ = ['Connection', 'Document', 'EmbeddedDocument', 'BucketDocument',
+           'MaterializedView',
+           'AnyField',
            'ObjectIdField', 'IntField', 'BooleanField', 'FloatField',
            'BinaryField', 'StringField', 'EmailField', 'DateTimeField',
            'DictField', 'ListField', 'EmbeddedField', 'SequenceField',
-           'EnumField',
-           'ShardKey', 'IDFormatter', 'Index']
+           'EnumField', 'ArrayField',
+           'ShardKey', 'IDFormatter', 'Index', 'Bucket', 'View',
+           'Session', 'session', 'deadline']
 
 __version__ = '0.2.35'
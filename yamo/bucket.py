@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import itertools
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from . import deadlines
+from .deadlines import with_timeout
+from .document import Document
+from .lazy import lazy_import
+from .errors import ConfigError, ValidationError
+
+operations = lazy_import('pymongo.operations')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def records_only(name, instead):
+    """ a Document method that makes no sense on bucketed records """
+    def method(*args, **kwargs):
+        raise ConfigError('{} is not supported on bucketed records, use {}'
+                          ''.format(name, instead))
+    method.__name__ = name
+    return method
+
+
+class BucketDocument(Document):
+
+    """ Document stored in buckets of records
+
+    Each instance is one record, declared and validated like a Document,
+    but records are written with $push into bucket documents shared by
+    all records of the same key and time window, see :class:`Bucket`.
+
+    A bucket document looks like::
+
+        {'_id': ObjectId(...), <key>: ..., 'start': <window start>,
+         'n': <number of records>, 'first': <min time>, 'last': <max time>,
+         'records': [{<time_field>: ..., <other fields>: ...}, ...]}
+
+    >>> Reading({'sensor': 's1', 'ts': now, 'value': 0.5}).save()
+    >>> Reading.append(*readings)
+    >>> Reading.query_records({'sensor': 's1'}, start=an_hour_ago)
+
+    query and query_one read records like query_records. Records can't
+    be loaded by _id, updated or removed one by one, those Document
+    methods raise ConfigError.
+    """
+    __abstract__ = True
+
+    get_many = records_only('get_many', 'query_records')
+    paginate = records_only('paginate', 'query_records')
+    parallel_query = records_only('parallel_query', 'query_records')
+    refresh = records_only('refresh', 'query_records')
+    update = records_only('update', 'append')
+    remove = records_only('remove', 'the bucket collection')
+    writer = records_only('writer', 'append')
+    import_stream = records_only('import_stream', 'append')
+
+    @classmethod
+    def _get_bucket(cls):
+        bucket = cls.Meta._bucket
+        if bucket is None:
+            raise ConfigError('{} declares no Bucket in Meta'
+                              ''.format(cls.__name__))
+        return bucket
+
+    @classmethod
+    def window_start(cls, ts):
+        """ start of the bucket window containing ts """
+        window = cls._get_bucket().window
+        seconds = (ts - EPOCH) // timedelta(seconds=1)
+        return EPOCH + timedelta(seconds=seconds - seconds % window)
+
+    @classmethod
+    def ensure_indexes(cls):
+        super(BucketDocument, cls).ensure_indexes()
+        bucket = cls._get_bucket()
+        cls._coll.create_index([(bucket.key, 1), ('start', 1)],
+                               background=True)
+
+    @classmethod
+    def _append_ops(cls, records):
+        bucket = cls._get_bucket()
+        # (key, window start) -> [record data]
+        groups = OrderedDict()
+        for record in records:
+            record._pre_save()
+            record._validate_for_write()
+            key = record._data.get(bucket.key)
+            ts = record._data.get(bucket.time_field)
+            if key is None:
+                raise ValidationError(cls, bucket.key, key)
+            if not isinstance(ts, datetime):
+                raise ValidationError(cls, bucket.time_field, ts)
+            data = {k: v for k, v in record._data.items()
+                    if k not in (bucket.key, '_id')}
+            groups.setdefault((key, cls.window_start(ts)), []).append(data)
+
+        for (key, start), datas in groups.items():
+            for i in range(0, len(datas), bucket.size):
+                chunk = datas[i:i + bucket.size]
+                times = [data[bucket.time_field] for data in chunk]
+                yield operations.UpdateOne(
+                    {bucket.key: key, 'start': start,
+                     'n': {'$lte': bucket.size - len(chunk)}},
+                    {'$push': {'records': {'$each': chunk}},
+                     '$inc': {'n': len(chunk)},
+                     '$min': {'first': min(times)},
+                     '$max': {'last': max(times)}},
+                    upsert=True)
+
+    @classmethod
+    @with_timeout
+    def append(cls, *records):
+        """ write records into their buckets, return number of updates """
+        requests = list(cls._append_ops(records))
+        if requests:
+            with deadlines.bounded(cls):
+                cls._coll.bulk_write(requests, ordered=False)
+        return len(requests)
+
+    @with_timeout
+    def save(self):
+        self.append(self)
+
+    @with_timeout
+    def upsert(self, null=False, insert_first=None):
+        self.append(self)
+
+    @classmethod
+    @with_timeout
+    def bulk_upsert(cls, docs, null=False, insert_first=None):
+        """ same as append, returns the number of inserted records like
+        Document.bulk_upsert, that is all of them
+        """
+        cls.append(*docs)
+        return len(docs)
+
+    @classmethod
+    def query(cls, filter=None, start=None, end=None):
+        """ same as query_records """
+        return cls.query_records(filter, start, end)
+
+    @classmethod
+    def query_one(cls, filter=None, start=None, end=None):
+        """ first record of query_records, None if there is none """
+        records = cls.query_records(filter, start, end)
+        try:
+            return next(records, None)
+        finally:
+            records.close()
+
+    @classmethod
+    def query_records(cls, filter=None, start=None, end=None):
+        """ Unroll buckets into record Documents
+
+        :param filter: filter on bucket documents, e.g. on the key field
+        :param start: only records whose time is >= start
+        :param end: only records whose time is < end
+
+        Records are yielded by key, then by time.
+        """
+        bucket = cls._get_bucket()
+        filter_ = dict(filter or {})
+        window = {}
+        if start is not None:
+            window['$gt'] = start - timedelta(seconds=bucket.window)
+        if end is not None:
+            window['$lt'] = end
+        if window:
+            filter_['start'] = window
+
+        def group(doc):
+            return doc.get(bucket.key), doc['start']
+
+        cursor = cls._coll.find(filter_, sort=[(bucket.key, 1),
+                                               ('start', 1)])
+        # full buckets leave several bucket documents for one window
+        for (key, _), docs in itertools.groupby(cursor, key=group):
+            records = [r for doc in docs for r in doc.get('records', [])]
+            records.sort(key=lambda r: r[bucket.time_field])
+            for data in records:
+                ts = data[bucket.time_field]
+                if (start is not None and ts < start) or \
+                        (end is not None and ts >= end):
+                    continue
+                data[bucket.key] = key
+                yield cls.from_storage(data)
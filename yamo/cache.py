@@ -1,12 +1,159 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import stat
 import time
 import types
 import pickle
 import functools
+import threading
+from collections import OrderedDict
 
+from .errors import ConfigError
+from .lazy import lazy_import
 
-from pymongo.cursor import Cursor
+cursor = lazy_import('pymongo.cursor')
+
+
+class MemoryBackend(object):
+
+    """ Cache backend local to the current process
+
+    Values are kept as they are, every hit returns the same objects:
+    don't modify them.
+    """
+
+    @staticmethod
+    def dumps(value):
+        return value
+
+    @staticmethod
+    def loads(payload):
+        return payload
+
+    def __init__(self):
+        # namespace -> key -> (cache_time, payload)
+        self.caches = {}
+
+    def get(self, ns, key):
+        return self.caches.get(ns, {}).get(key)
+
+    def set(self, ns, key, cache_time, payload):
+        self.caches.setdefault(ns, {})[key] = (cache_time, payload)
+
+    def expire(self, ns, before):
+        cache = self.caches.get(ns, {})
+        invals = [key for key, values in list(cache.items())
+                  if values[0] < before]
+        for key in invals:
+            cache.pop(key, None)
+
+
+class SQLiteBackend(object):
+
+    """ Cache backend shared by all processes on a host
+
+    :param path: database file, put it on a tmpfs (e.g. /dev/shm) for
+                 the best performance, defaults to a file in a private
+                 directory of the current user under the temp dir
+
+    Cached values are unpickled, so whoever can write the file can run
+    code in every process using the cache: the file is a trust boundary.
+    It is created with mode 0600, and an existing file must be owned by
+    the current user and not writable by anyone else.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            import tempfile
+            path = os.path.join(tempfile.gettempdir(),
+                                'yamo-{}'.format(_user_id()),
+                                'cache.sqlite')
+            _private_dir(os.path.dirname(path))
+        self.path = path
+        self.local = threading.local()
+
+    @staticmethod
+    def dumps(value):
+        """ serialize a cached value, Documents pickle as raw BSON """
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    loads = staticmethod(pickle.loads)
+
+    def _check_file(self):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+        fd = os.open(self.path, flags, 0o600)
+        try:
+            _check_owner(self.path, os.fstat(fd))
+        finally:
+            os.close(fd)
+        for suffix in ('-wal', '-shm'):
+            try:
+                st = os.lstat(self.path + suffix)
+            except FileNotFoundError:
+                continue
+            _check_owner(self.path + suffix, st)
+
+    @property
+    def conn(self):
+        # sqlite connections must not cross threads or forks
+        if getattr(self.local, 'pid', None) != os.getpid():
+            import sqlite3
+            self._check_file()
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'ns TEXT, key BLOB, ts REAL, value BLOB, '
+                         'PRIMARY KEY (ns, key)) WITHOUT ROWID')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def get(self, ns, key):
+        row = self.conn.execute(
+            'SELECT ts, value FROM cache WHERE ns = ? AND key = ?',
+            (ns, key)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, ns, key, cache_time, payload):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO cache (ns, key, ts, value) '
+            'VALUES (?, ?, ?, ?)', (ns, key, cache_time, payload))
+
+    def expire(self, ns, before):
+        self.conn.execute('DELETE FROM cache WHERE ns = ? AND ts < ?',
+                          (ns, before))
+
+
+def _user_id():
+    if hasattr(os, 'getuid'):
+        return os.getuid()
+    import getpass
+    return getpass.getuser()
+
+
+def _check_owner(path, st):
+    """ refuse cache files other users could have written """
+    if not hasattr(os, 'getuid'):
+        return
+    if st.st_uid != os.getuid() or st.st_mode & 0o022 or \
+            stat.S_ISLNK(st.st_mode):
+        raise ConfigError('Cache file {} is not private to the current '
+                          'user'.format(path))
+
+
+def _private_dir(path):
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise ConfigError('Cache directory {} is not a directory'
+                          ''.format(path))
+    _check_owner(path, st)
 
 
 class CachedModel(object):
@@ -15,56 +162,84 @@ class CachedModel(object):
 
     :param timeout: timeout in seconds
     :param cache_none: whether to cache None results
+    :param backend: where to keep cached values, defaults to
+                    `CachedModel.backend`
+
+    Set `CachedModel.backend = SQLiteBackend()` at startup to share one
+    warm cache between all processes of a host.
     """
-    # cls -> (cache_time, value)
-    caches = {}
+    backend = MemoryBackend()
 
-    def __init__(self, cls, timeout=300, cache_none=False):
+    def __init__(self, cls, timeout=300, cache_none=False, backend=None):
         self.cls = cls
         self.timeout = timeout
         self.cache_none = cache_none
         self.count = 0
-        if self.cls not in self.caches:
-            self.caches[self.cls] = {}
+        if backend is not None:
+            self.backend = backend
+        self.ns = '{}.{}'.format(cls.__module__, cls.__qualname__)
 
     def _clear_timeout(self):
-        cache = self.caches[self.cls]
-        now = time.time()
-        invals = []
-        for key, values in cache.items():
-            if values[0] < now - self.timeout:
-                invals.append(key)
-        for key in invals:
-            del cache[key]
+        self.backend.expire(self.ns, time.time() - self.timeout)
 
-    def __getattr__(self, name):
+    def _tick(self):
         self.count += 1
         if self.count % 1000 == 0:
             self._clear_timeout()
 
+    @staticmethod
+    def _key(name, args, kwargs):
+        return pickle.dumps([name, args, kwargs])
+
+    def _expired(self, cached):
+        return cached is None or cached[0] < time.time() - self.timeout
+
+    def get_many(self, ids, chunk_size=500, missing='skip', workers=4):
+        """ Model.get_many, sharing entries with query_one({'_id': ...}) """
+        self._tick()
+        self.cls._check_missing(missing)
+        found = {}
+        misses = OrderedDict()
+        for _id in OrderedDict.fromkeys(ids):
+            key = self._key('query_one', ({'_id': _id},), {})
+            cached = self.backend.get(self.ns, key)
+            if self._expired(cached):
+                misses[_id] = key
+            else:
+                found[_id] = self.backend.loads(cached[1])
+
+        if misses:
+            fetched = self.cls._fetch_ids(list(misses), chunk_size, workers)
+            for _id, key in misses.items():
+                doc = fetched.get(_id)
+                if doc is not None or self.cache_none:
+                    self.backend.set(self.ns, key, time.time(),
+                                     self.backend.dumps(doc))
+                found[_id] = doc
+        return self.cls._order_ids(ids, found, missing)
+
+    def __getattr__(self, name):
+        self._tick()
+
         attr = getattr(self.cls, name)
         if callable(attr):
             # wrap this callable to use cache
             @functools.wraps(attr)
             def deco(*args, **kwargs):
-                cache = self.caches[self.cls]
-                key = pickle.dumps([attr.__name__, args, kwargs])
-                cache_miss = key not in cache
-
-                def timedout():
-                    return cache[key][0] < time.time() - self.timeout
+                key = self._key(attr.__name__, args, kwargs)
+                cached = self.backend.get(self.ns, key)
 
-                if cache_miss or timedout():
+                if self._expired(cached):
                     value = attr(*args, **kwargs)
-                    if isinstance(value, Cursor) or \
+                    if isinstance(value, cursor.Cursor) or \
                             isinstance(value, types.GeneratorType):
                         # this will consume A LOT of memory, use with care
                         value = list(value)
                     if value is not None or self.cache_none:
-                        cache[key] = (time.time(), value)
-                    else:
-                        return
-                return cache[key][1]
+                        self.backend.set(self.ns, key, time.time(),
+                                         self.backend.dumps(value))
+                    return value
+                return self.backend.loads(cached[1])
             return deco
         else:
             return attr
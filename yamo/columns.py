@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from . import deadlines
+from .errors import ArgumentError
+from .lazy import lazy_import
+from .fields import (BaseField, IntField, FloatField, BooleanField,
+                     DateTimeField)
+
+bson = lazy_import('bson')
+
+# field class -> numpy dtype of its column, first match wins
+COLUMN_DTYPES = [
+    (BooleanField, 'bool'),
+    (IntField, 'int64'),
+    (FloatField, 'float64'),
+    (DateTimeField, 'datetime64[ms]'),
+]
+
+
+def column_dtype(field):
+    for field_cls, dtype in COLUMN_DTYPES:
+        if isinstance(field, field_cls):
+            return dtype
+
+
+def to_array(values, dtype):
+    """ build a numpy column, falling back when values are missing """
+    import numpy
+    if dtype in ('int64', 'bool') and None in values:
+        if dtype == 'bool':
+            return numpy.array(values, dtype=object)
+        dtype = 'float64'
+    if dtype == 'float64':
+        values = [numpy.nan if v is None else v for v in values]
+    return numpy.array(values, dtype=dtype)
+
+
+def query_columns(cls, filter=None, fields=None, **kwargs):
+    """ run a find and collect the results per field, see Model.query_columns
+    """
+    if fields is None:
+        fields = list(cls._fields)
+    for name in fields:
+        if name not in cls._fields and name != '_id':
+            raise ArgumentError(query_columns, name)
+
+    projection = {name: 1 for name in fields}
+    if '_id' not in fields:
+        projection['_id'] = 0
+
+    columns = OrderedDict((name, []) for name in fields)
+    appends = [(name, columns[name].append) for name in fields]
+    kwargs = deadlines.find_kwargs(cls, kwargs)
+    coll = cls._coll
+    batches = coll.find_raw_batches(filter, projection, **kwargs)
+    for batch in deadlines.translate(cls, batches):
+        for data in bson.decode_all(batch, coll.codec_options):
+            for name, append in appends:
+                append(data.get(name))
+
+    try:
+        import numpy  # noqa
+    except ImportError:
+        numpy = None
+
+    for name in fields:
+        field = cls._fields.get(name)
+        dtype = column_dtype(field) if field is not None else None
+        if dtype and numpy is not None:
+            columns[name] = to_array(columns[name], dtype)
+        elif field is not None and \
+                type(field).to_python is not BaseField.to_python:
+            columns[name] = [field.to_python(v) for v in columns[name]]
+    return columns
@@ -1,20 +1,24 @@
+import os
 import time
 import queue
 import pickle
+import weakref
 import functools
 import threading
 
 
 task = queue.Queue()
 prepared = {}
+started = []
 
 
 def myopen(oldopen, conn):
+    bg_prepare()
     task.put(conn)
     return oldopen()
 
 
-def bg_prepare(started=[]):
+def bg_prepare():
     def _prepare(prepared={}):
         while True:
             try:
@@ -30,7 +34,98 @@ def bg_prepare(started=[]):
         threading.Thread(target=_prepare, daemon=True).start()
 
 
-bg_prepare()
+class PoolStats(object):
+
+    """ Connection pool statistics of one MongoClient, fed by CMAP events
+
+    `wait_time` and `max_wait_time` are seconds spent waiting for a
+    connection to be checked out of the pool.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.clears = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        # thread -> check out started at
+        self.waiting = {}
+
+    def as_dict(self):
+        with self.lock:
+            return {'created': self.created,
+                    'closed': self.closed,
+                    'open': self.created - self.closed,
+                    'checked_out': self.checked_out,
+                    'checkouts': self.checkouts,
+                    'checkout_failures': self.checkout_failures,
+                    'clears': self.clears,
+                    'wait_time': self.wait_time,
+                    'max_wait_time': self.max_wait_time}
+
+    def _waited(self):
+        started = self.waiting.pop(threading.get_ident(), None)
+        if started is not None:
+            waited = time.monotonic() - started
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.waiting[threading.get_ident()] = time.monotonic()
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self._waited()
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self._waited()
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.closed += 1
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+def pool_listener():
+    """ a PoolStats registrable as a pymongo event listener, or None """
+    try:
+        from pymongo.monitoring import ConnectionPoolListener
+    except ImportError:
+        return None
+    return type('PoolStatsListener',
+                (PoolStats, ConnectionPoolListener), {})()
 
 
 class Connection(object):
@@ -41,6 +136,17 @@ class Connection(object):
     ...     pass
     >>> conn = Connection(host="localhost", port=27017)
     >>> conn.register(Post)
+
+    Clients are shared by all Connections with the same arguments, and
+    rebuilt in a forked child, since the ones inherited from the parent
+    have unusable pools and monitor threads.
+
+    Pool sizes can be set per process type, the type is taken from the
+    `process_type` argument or the `YAMO_PROCESS_TYPE` environment:
+
+    >>> Connection.pool_policies = {'web': {'maxPoolSize': 10},
+    ...                             'worker': {'maxPoolSize': 2}}
+    >>> Connection.set_process_type('worker')  # e.g. in post_fork
     """
     # Document -> DB
     docdb = {}
@@ -48,25 +154,82 @@ class Connection(object):
     # host, port, *args, **kwargs -> mongoclient
     mcs = {}
 
+    # host, port, *args, **kwargs -> PoolStats
+    stats = {}
+
+    # process type -> MongoClient kwargs
+    pool_policies = {}
+    process_type = os.environ.get('YAMO_PROCESS_TYPE')
+
+    instances = weakref.WeakSet()
+    lock = threading.RLock()
+
     def __init__(self, host=None, port=None, db=None, *args, **kwargs):
-        # in case pymongo is not installed when setup yamo
-        import pymongo
         if host and '/' in host:
             host, db = host.rsplit('/', 1)
         if not db:
             db = 'test'
 
+        self.process_type = kwargs.pop('process_type', self.process_type)
+        self.args = (host, port, db, args, kwargs)
+        self.docs = set()
+        self._connect()
+        self.instances.add(self)
+
+    def _connect(self):
+        # in case pymongo is not installed when setup yamo
+        import pymongo
+        host, port, db, args, kwargs = self.args
+        kwargs = dict(kwargs)
+        for key, value in self.pool_policies.get(self.process_type,
+                                                 {}).items():
+            kwargs.setdefault(key, value)
+
         kwargs['connect'] = False
         key = pickle.dumps((host, port, db, args, kwargs))
-        if key not in self.mcs:
-            self.client = pymongo.MongoClient(host, port, *args, **kwargs)
-            self.mcs[key] = self.client
-        else:
-            self.client = self.mcs[key]
+        with self.lock:
+            if key not in self.mcs:
+                listener = pool_listener()
+                if listener is not None:
+                    kwargs['event_listeners'] = \
+                        list(kwargs.get('event_listeners', [])) + [listener]
+                    self.stats[key] = listener
+                self.mcs[key] = pymongo.MongoClient(host, port,
+                                                    *args, **kwargs)
+        self.key = key
+        self.client = self.mcs[key]
         oldopen = self.client._topology.open
         self.client._topology.open = functools.partial(
             myopen, oldopen=oldopen, conn=self)
         self.db = self.client[db]
+        for doc in self.docs:
+            self.docdb[doc] = self.db
+            doc._db = self.db
+
+    @classmethod
+    def _after_fork(cls):
+        """ rebuild all clients in a forked child """
+        global task
+        # the lock may have been held by another thread of the parent
+        cls.lock = threading.RLock()
+        task = queue.Queue()
+        cls.mcs.clear()
+        cls.stats.clear()
+        del started[:]
+        for conn in list(cls.instances):
+            conn._connect()
+
+    @classmethod
+    def set_process_type(cls, process_type):
+        """ switch pool policy, applied when clients are next built """
+        cls.process_type = process_type
+        for conn in list(cls.instances):
+            conn.process_type = process_type
+
+    def pool_stats(self):
+        """ pool statistics of this connection's client """
+        stats = self.stats.get(self.key)
+        return stats.as_dict() if stats else {}
 
     def register_all(self):
         self.register(*self.docdb.keys())
@@ -81,5 +244,10 @@ class Connection(object):
         except:
             self.docdb[doc] = self.db
             doc._db = self.db
+            self.docs.add(doc)
         else:
             self.docdb[doc] = doc._db
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=Connection._after_fork)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Deadlines of ORM operations
+
+    >>> with yamo.deadline(0.2):
+    ...     post = Post.query_one({'_id': 1})
+    ...     post.save()
+    >>> Post.query_one({'_id': 1}, timeout=0.05)
+
+Inside a deadline, finds and aggregates get max_time_ms, single round
+trips also run in pymongo.timeout (pymongo >= 4.2, it covers waiting for
+a pooled connection and socket reads), and operations made of several
+round trips check the deadline between them. Running out of time raises
+:class:`~yamo.errors.DeadlineExceeded` and counts a 'deadline_exceeded'
+event in :mod:`yamo.metrics`.
+"""
+import time
+import functools
+import threading
+import contextlib
+
+from . import metrics
+from .errors import DeadlineExceeded
+from .lazy import lazy_import
+
+pymongo = lazy_import('pymongo')
+errors = lazy_import('pymongo.errors')
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """ bound the time of the operations in this block of this thread,
+    nested deadlines can only shorten the current one
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    at = time.monotonic() + seconds
+    if stack:
+        at = min(at, stack[-1])
+    stack.append(at)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def remaining():
+    """ seconds left before the current deadline, None without one """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1] - time.monotonic()
+
+
+def expired(cls, cause=None):
+    metrics.incr('deadline_exceeded', cls)
+    raise DeadlineExceeded(cls) from cause
+
+
+def check(cls):
+    """ raise DeadlineExceeded if the current deadline has passed """
+    left = remaining()
+    if left is not None and left <= 0:
+        expired(cls)
+
+
+def is_timeout(e):
+    return isinstance(e, errors.ExecutionTimeout) or \
+        getattr(e, 'timeout', False)
+
+
+def find_kwargs(cls, kwargs, name='max_time_ms'):
+    """ kwargs of a find with max_time_ms for the deadline, use
+    name='maxTimeMS' for aggregate
+    """
+    left = remaining()
+    if left is None:
+        return kwargs
+    if left <= 0:
+        expired(cls)
+    ms = max(1, int(left * 1000))
+    if kwargs.get(name):
+        ms = min(ms, kwargs[name])
+    return dict(kwargs, **{name: ms})
+
+
+@contextlib.contextmanager
+def bounded(cls):
+    """ run one round trip within the current deadline
+
+    Not for generators: pymongo.timeout would leak into the caller.
+    """
+    left = remaining()
+    if left is None:
+        yield
+        return
+    if left <= 0:
+        expired(cls)
+    timeout = getattr(pymongo, 'timeout', None)
+    try:
+        if timeout is None:
+            yield
+        else:
+            with timeout(left):
+                yield
+    except errors.PyMongoError as e:
+        if is_timeout(e):
+            expired(cls, e)
+        raise
+
+
+def translate(cls, cursor):
+    """ iterate cursor, raising DeadlineExceeded on server timeouts """
+    try:
+        for doc in cursor:
+            yield doc
+    except errors.ExecutionTimeout as e:
+        expired(cls, e)
+
+
+def with_timeout(func):
+    """ add a `timeout` argument in seconds, a deadline for this call """
+    @functools.wraps(func)
+    def wrapper(*args, timeout=None, **kwargs):
+        if timeout is None:
+            return func(*args, **kwargs)
+        with deadline(timeout):
+            return func(*args, **kwargs)
+    return wrapper
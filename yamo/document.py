@@ -3,16 +3,38 @@
 import logging
 
 from functools import partialmethod
-
-from pymongo.operations import UpdateOne, InsertOne
+from collections import OrderedDict
 
 from .cache import CachedModel
-from .errors import ConfigError, ArgumentError
+from .mirror import Mirror, MISS
+from .writer import WriteBehind
+from .unitofwork import current_session
+from .errors import (ConfigError, ArgumentError, DocumentNotFound,
+                     BatchValidationError)
 from .metatype import DocumentType, EmbeddedDocumentType
+from .columns import query_columns
+from .importer import import_stream
+from .parallel import parallel_query
+from .pagination import (Page, sort_keys, check_index, seek_filter,
+                         get_path, encode_token, decode_token)
 from .fields import EmbeddedField
+from .lazy import lazy_import
+from .packing import reduce_document
+from . import explain, metrics, deadlines
+from .deadlines import with_timeout
+from .prefetch import Prefetcher, MAX_BYTES
 
 log = logging.getLogger('yamo')
 
+operations = lazy_import('pymongo.operations')
+errors = lazy_import('pymongo.errors')
+
+# (Document class, filter shape) of queries already warned about
+UNTARGETED = set()
+
+# what get_many does about unknown ids
+MISSING = ('skip', 'none', 'raise')
+
 
 class classproperty(object):
 
@@ -30,7 +52,15 @@ class MongoOperationMixin(object):
     def run_command(cls, *args, **kwargs):
         cmd = kwargs['cmd']
         del kwargs['cmd']
-        return getattr(cls._coll, cmd)(*args, **kwargs)
+        if cmd in ('find', 'find_one'):
+            kwargs = deadlines.find_kwargs(cls, kwargs)
+        elif cmd == 'aggregate':
+            kwargs = deadlines.find_kwargs(cls, kwargs, 'maxTimeMS')
+        if cmd == 'find':
+            # lazy cursor, bounded by max_time_ms only
+            return cls._coll.find(*args, **kwargs)
+        with deadlines.bounded(cls):
+            return getattr(cls._coll, cmd)(*args, **kwargs)
 
     for cmd in [
         'insert_one', 'insert_many',
@@ -62,28 +92,84 @@ class InitMixin(object):
         self._refs = {}
         self._data = {}
         self._defaults = {}
+        # names of the fields assigned since loaded, None for new documents
+        self._changed = None
         if data:
-            for name, field in self._fields.items():
-                if name in data:
-                    value = data[name]
-                else:
-                    value = field.default
-                    if callable(value):
-                        value = value()
-                    if value is not None:
-                        self._defaults[name] = value
+            self._fill(data)
 
-                value = field.to_storage(value)
-                self._data[name] = value
+    def _fill(self, data):
+        """ set every field from data, or to its default """
+        for name, field in self._fields.items():
+            if name in data:
+                value = data[name]
+            else:
+                value = field.default
+                if callable(value):
+                    value = value()
+                if value is not None:
+                    self._defaults[name] = value
+
+            value = field.to_storage(value)
+            self._data[name] = value
+
+    def __reduce__(self):
+        return reduce_document(self)
 
 
 class ValidationMixin(object):
 
-    def validate(self):
-        for name, field in self._fields.items():
+    def validate(self, names=None):
+        """ validate all fields, or only the given field names """
+        for name in self._fields if names is None else names:
             if name in self._data:
-                value = field.to_python(self._data[name])
-                field.validate(value)
+                self._fields[name].validate_storage(self._data[name])
+
+    @classmethod
+    def validate_batch(cls, docs, changed_only=False):
+        """ validate many documents, one field at a time
+
+        :param changed_only: only fields assigned since loaded, for the
+                             documents that were loaded
+
+        Same result as validate() on each document, but all failures are
+        raised at once with :class:`~yamo.errors.BatchValidationError`.
+        """
+        checks = cls.__dict__.get('_checks')
+        if checks is None:
+            checks = {name: field.compile_check()
+                      for name, field in cls._fields.items()}
+            cls._checks = checks
+
+        failures = []
+        for name, check in checks.items():
+            indexes = []
+            values = []
+            for i, doc in enumerate(docs):
+                data = doc._data
+                if name in data and not (changed_only and
+                                         doc._changed is not None and
+                                         name not in doc._changed):
+                    indexes.append(i)
+                    values.append(data[name])
+            for j in check(values):
+                failures.append((indexes[j], name, values[j]))
+        if failures:
+            failures.sort(key=lambda f: f[0])
+            raise BatchValidationError(cls, failures)
+
+    @classmethod
+    def json_schema(cls):
+        """ $jsonSchema equivalent to validate() """
+        required = []
+        properties = {}
+        for name, field in cls._fields.items():
+            if field.required and not field.nullable:
+                required.append(name)
+            properties[name] = field.json_schema()
+        schema = {'bsonType': 'object', 'properties': properties}
+        if required:
+            schema['required'] = sorted(required)
+        return schema
 
     def to_dict(self):
         d = {}
@@ -105,20 +191,38 @@ class MetaMixin(object):
 
     @classproperty
     def unique_fields(cls):
-        names = set()
-        for idx in cls.Meta._indexes or []:
-            if idx.kwargs.get('unique'):
-                for key in idx.keys:
-                    if isinstance(key, tuple):
-                        names.add(key[0])
-                    else:
-                        names.add(key)
-        return names
+        return cls.Meta._unique_fields
 
     @classmethod
     def prepare(cls):
         cls.ensure_indexes()
         cls.ensure_shards()
+        cls.ensure_validator()
+
+    @classmethod
+    def ensure_validator(cls):
+        """ install json_schema() as the collection validator
+
+        Only if Meta.server_validation is set, it defaults to True when
+        Meta.client_validation is not 'full'.
+        """
+        meta = cls.Meta
+        if not meta._server_validation:
+            return
+        options = {'validator': {'$jsonSchema': cls.json_schema()},
+                   'validationLevel': meta._validation_level,
+                   'validationAction': meta._validation_action}
+        try:
+            cls._db.command('collMod', meta.__collection__, **options)
+        except errors.OperationFailure as e:
+            # NamespaceNotFound
+            if e.code != 26:
+                raise
+            try:
+                cls._db.create_collection(meta.__collection__, **options)
+            except errors.CollectionInvalid:
+                # created meanwhile by another process
+                cls._db.command('collMod', meta.__collection__, **options)
 
     @classmethod
     def ensure_indexes(cls):
@@ -158,112 +262,457 @@ class MapperMixin(object):
 
     """ ORM only method mixins """
 
+    @with_timeout
     def refresh(self):
         _id = self._data.get('_id')
+        filter_ = self._target_filter() if _id else None
         self._data = {}
         if _id:
-            doc = self._coll.find_one({'_id': _id})
+            with deadlines.bounded(type(self)):
+                doc = self._coll.find_one(
+                    filter_, **deadlines.find_kwargs(type(self), {}))
             if doc:
                 self._data = doc
                 self.validate()
 
     @classmethod
-    def query(cls, *args, **kwargs):
-        """ Same as collection.find, but return Document then dict """
-        for doc in cls._coll.find(*args, **kwargs):
-            yield cls.from_storage(doc)
+    @with_timeout
+    def query(cls, *args, prefetch=None, prefetch_bytes=MAX_BYTES,
+              **kwargs):
+        """ Same as collection.find, but return Document then dict
+
+        :param timeout: seconds, see :func:`yamo.deadline`
+        :param prefetch: number of batches fetched and decoded ahead by
+                         a background thread, see :mod:`yamo.prefetch`
+        :param prefetch_bytes: max raw bytes of the batches fetched ahead
+        """
+        filter_ = args[0] if args else kwargs.get('filter')
+        cls._check_targeted(filter_)
+        if explain.recorder is not None:
+            explain.recorder.sample(cls, filter_, kwargs.get('sort'))
+        kwargs = deadlines.find_kwargs(cls, kwargs)
+        if prefetch:
+            cursor = cls._coll.find_raw_batches(*args, **kwargs)
+            return iter(Prefetcher(cls, cursor, prefetch, prefetch_bytes))
+        cursor = cls._coll.find(*args, **kwargs)
+        return (cls.from_storage(doc)
+                for doc in deadlines.translate(cls, cursor))
 
     @classmethod
+    @with_timeout
     def query_one(cls, *args, **kwargs):
-        """ Same as collection.find_one, but return Document then dict """
-        doc = cls._coll.find_one(*args, **kwargs)
+        """ Same as collection.find_one, but return Document then dict
+
+        :param timeout: seconds, see :func:`yamo.deadline`
+        """
+        mirror = Mirror.mirrors.get(cls)
+        if mirror is not None:
+            doc = mirror.lookup(*args, **kwargs)
+            if doc is not MISS:
+                if doc:
+                    return cls.from_storage(doc)
+                return
+        filter_ = args[0] if args else kwargs.get('filter')
+        cls._check_targeted(filter_)
+        if explain.recorder is not None:
+            explain.recorder.sample(cls, filter_, kwargs.get('sort'))
+        with deadlines.bounded(cls):
+            doc = cls._coll.find_one(*args,
+                                     **deadlines.find_kwargs(cls, kwargs))
         if doc:
             return cls.from_storage(doc)
 
+    @classmethod
+    @with_timeout
+    def get_many(cls, ids, chunk_size=500, missing='skip', workers=4):
+        """ Load Documents by _id, in the order of ids
+
+        :param ids: _id values, duplicates are fetched once
+        :param chunk_size: max ids per $in query
+        :param missing: 'skip' unknown ids, put 'none' in their place, or
+                        'raise' :class:`~yamo.errors.DocumentNotFound`
+        :param workers: max chunks queried at the same time
+        :param timeout: seconds, see :func:`yamo.deadline`
+
+        >>> Post.get_many([3, 1, 2])
+        >>> Post.cached(60).get_many(ids)  # only fetch the cache misses
+        """
+        cls._check_missing(missing)
+        found = cls._fetch_ids(ids, chunk_size, workers)
+        return cls._order_ids(ids, found, missing)
+
+    @classmethod
+    def _check_missing(cls, missing):
+        if missing not in MISSING:
+            raise ArgumentError(cls.get_many, missing)
+
+    @classmethod
+    def _fetch_ids(cls, ids, chunk_size=500, workers=4):
+        """ {_id: Document} of the ids found """
+        found = {}
+        todo = []
+        mirror = Mirror.mirrors.get(cls)
+        for _id in OrderedDict.fromkeys(ids):
+            if mirror is not None:
+                data = mirror.lookup({'_id': _id})
+                if data is not MISS:
+                    if data:
+                        found[_id] = cls.from_storage(data)
+                    continue
+            todo.append(_id)
+
+        # deadlines are per thread, apply this one in the pool too
+        kwargs = deadlines.find_kwargs(cls, {})
+
+        def fetch(chunk):
+            cursor = cls._coll.find({'_id': {'$in': chunk}}, **kwargs)
+            return list(deadlines.translate(cls, cursor))
+
+        chunks = [todo[i:i + chunk_size]
+                  for i in range(0, len(todo), chunk_size)]
+        if len(chunks) > 1 and workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(min(workers, len(chunks))) as pool:
+                results = list(pool.map(fetch, chunks))
+        else:
+            results = map(fetch, chunks)
+        # Documents are built here, in the session of this thread
+        for datas in results:
+            for data in datas:
+                found[data['_id']] = cls.from_storage(data)
+        return found
+
+    @classmethod
+    def _order_ids(cls, ids, found, missing):
+        if missing == 'raise':
+            unknown = [_id for _id in ids if found.get(_id) is None]
+            if unknown:
+                raise DocumentNotFound(cls, unknown)
+        docs = []
+        for _id in ids:
+            doc = found.get(_id)
+            if doc is not None or missing == 'none':
+                docs.append(doc)
+        return docs
+
+    @classmethod
+    def query_columns(cls, filter=None, fields=None, **kwargs):
+        """ Same as collection.find, but return columns instead of Documents
+
+        :param filter: same as collection.find
+        :param fields: names of the fields to return, all fields if None
+        :param kwargs: other arguments of collection.find_raw_batches
+
+        Rows of the raw BSON batches are decoded to dicts whose values are
+        appended to one column per field, no Document is built. Bool, int, float and datetime fields become
+        numpy arrays if numpy is installed (ints with missing values
+        become floats with NaN), other fields lists of python values.
+
+        >>> cols = Model.query_columns({...}, fields=['ts', 'value'])
+        >>> cols['value'].mean()
+        """
+        return query_columns(cls, filter, fields, **kwargs)
+
+    @classmethod
+    def paginate(cls, filter=None, order_by=None, page_size=20, token=None):
+        """ Keyset pagination, yield pages of Documents
+
+        :param filter: same as collection.find
+        :param order_by: list of keys or (key, direction) pairs,
+                         `_id` is appended as a tiebreaker unless a
+                         unique index covers the keys
+        :param page_size: max number of Documents per page
+        :param token: `Page.token` of the previous page, to continue from
+
+        Each page is fetched with a range predicate on the sort keys
+        instead of skip, so deep pages cost the same as the first one.
+        A Meta Index must support order_by, _id included, e.g.
+        Index([('created_at', 1), ('_id', 1)]).
+
+        >>> page = next(Model.paginate({...}, ['created_at'], 50, token))
+        >>> page.token  # pass back to get the next page
+        """
+        keys = check_index(cls, sort_keys(order_by))
+        values = decode_token(keys, token) if token else None
+        first = True
+        while True:
+            filter_ = filter
+            if values is not None:
+                seek = seek_filter(keys, values)
+                filter_ = {'$and': [filter, seek]} if filter else seek
+            docs = list(cls.query(filter_, sort=keys, limit=page_size + 1))
+            if not docs and not first:
+                return
+            first = False
+            if len(docs) <= page_size:
+                yield Page(docs)
+                return
+            docs = docs[:page_size]
+            values = [get_path(docs[-1]._data, k) for k, _ in keys]
+            yield Page(docs, encode_token(keys, values))
+
+    @with_timeout
     def update(self, update):
         """ Update self """
-        self._coll.update_one({'_id': self._data['_id']},
-                              update)
-
-    def upsert(self, null=False):
+        session = current_session()
+        if session is not None:
+            return session.update(self, update)
+        with deadlines.bounded(type(self)):
+            self._coll.update_one(self._target_filter(), update)
+
+    @with_timeout
+    def upsert(self, null=False, insert_first=None):
         """ Insert or Update Document
 
         :param null: whether update null values
-        Wisely select unique field values as filter,
+        :param insert_first: when _id is known, try insert_one before
+                             updating, defaults to Meta.insert_first
+        Filter by _id if known, otherwise by the values of a unique index,
         Update with upsert=True
+
+        Insert first is faster when most documents are new, e.g. with
+        ids made by an IDFormatter.
         """
         self._pre_save()
-        self.validate()
+        self._validate_for_write()
 
+        session = current_session()
+        if session is not None:
+            return session.upsert(self, null)
+
+        if insert_first is None:
+            insert_first = self.Meta._insert_first
         filter_ = self._upsert_filter()
+        with deadlines.bounded(type(self)):
+            self._upsert(filter_, null, insert_first)
+
+    def _upsert(self, filter_, null, insert_first):
         if filter_:
             update = self._upsert_update(filter_, null)
 
             if update['$set']:
-                r = self._coll.find_one_and_update(filter_, update,
-                                                   upsert=True, new=True)
-                self._data['_id'] = r['_id']
+                if '_id' in filter_:
+                    if insert_first:
+                        try:
+                            self._coll.insert_one(self._insert_doc(null))
+                            return
+                        except errors.DuplicateKeyError:
+                            pass
+                    self._coll.update_one(filter_, update, upsert=True)
+                else:
+                    r = self._coll.find_one_and_update(
+                        filter_, update, projection={'_id': True},
+                        upsert=True, new=True)
+                    self._data['_id'] = r['_id']
         else:
             r = self._coll.insert_one(self._data)
             self._data['_id'] = r.inserted_id
 
+    @with_timeout
     def save(self):
         self._pre_save()
         self._ensure_id()
-        self.validate()
-
-        if '_id' in self._data:
-            doc = self._data.copy()
-            del doc['_id']
-            self._coll.update_one({'_id': self._data['_id']},
-                                  {'$set': doc},
-                                  upsert=True)
-        else:
-            self._coll.insert_one(self._data)
+        self._validate_for_write()
+
+        session = current_session()
+        if session is not None:
+            return session.save(self)
+
+        with deadlines.bounded(type(self)):
+            if '_id' in self._data:
+                doc = self._data.copy()
+                del doc['_id']
+                self._coll.update_one(self._target_filter(), {'$set': doc},
+                                      upsert=True)
+            else:
+                self._coll.insert_one(self._data)
 
     @classmethod
-    def bulk_upsert(cls, docs, null=False):
+    @with_timeout
+    def bulk_upsert(cls, docs, null=False, insert_first=None):
+        """ upsert many Documents with one unordered bulk_write
+
+        With a ShardKey, operations are sent grouped by shard key, so
+        mongos splits them in as few batches as possible.
+
+        With insert_first (defaults to Meta.insert_first), Documents
+        whose _id is known are sent with an unordered insert_many first,
+        only those already existing are updated afterwards.
+
+        Returns the number of inserted documents. With a deadline, it is
+        checked between the round trips.
+        """
         if len(docs) == 0:
             return 0
+        if insert_first is None:
+            insert_first = cls.Meta._insert_first
         requests = []
+        inserts = []
 
         for doc in docs:
             if not isinstance(doc, cls):
                 raise ArgumentError(cls, docs)
             doc._pre_save()
-            doc.validate()
-            filter_ = doc._upsert_filter()
-            if filter_:
-                update = doc._upsert_update(filter_, null)
-                if update['$set']:
-                    requests.append(UpdateOne(filter_, update, upsert=True))
+        mode = cls.Meta._client_validation
+        if mode != 'off':
+            cls.validate_batch(docs, changed_only=mode == 'changed')
+
+        for doc in cls._shard_order(docs):
+            op = doc._upsert_op(null)
+            if op is None:
+                continue
+            if insert_first and doc._data.get('_id') is not None:
+                inserts.append((doc, op))
             else:
-                requests.append(InsertOne(doc._data))
-        r = cls._coll.bulk_write(requests, ordered=False)
-        return r.upserted_count
+                requests.append(op)
+
+        inserted = 0
+        if inserts:
+            try:
+                with deadlines.bounded(cls):
+                    cls._coll.insert_many(
+                        [doc._insert_doc(null) for doc, _ in inserts],
+                        ordered=False)
+                inserted = len(inserts)
+            except errors.BulkWriteError as e:
+                write_errors = e.details['writeErrors']
+                if any(err['code'] != 11000 for err in write_errors):
+                    raise
+                inserted = e.details['nInserted']
+                requests += [inserts[err['index']][1]
+                             for err in write_errors]
+        if requests:
+            with deadlines.bounded(cls):
+                r = cls._coll.bulk_write(requests, ordered=False)
+            inserted += r.upserted_count
+        return inserted
+
+    @classmethod
+    def import_stream(cls, source, format='jsonl', mode='upsert',
+                      workers=None, chunk_size=1000, max_pending=None,
+                      null=False, on_reject=None):
+        """ Import JSONL/CSV rows
+
+        :param source: file path, or iterable of lines
+        :param format: 'jsonl' or 'csv'
+        :param mode: 'upsert' (same as bulk_upsert) or 'insert'
+        :param workers: size of the process pool parsing and validating
+                        rows, 0 to do everything in this process
+        :param chunk_size: rows per worker task and per bulk_write
+        :param max_pending: max chunks in flight, 2 * workers by default
+        :param null: whether upsert null values
+        :param on_reject: callback(line number, row, error) for rows
+                          failing to parse, validate or write
+
+        Rows are read and written here, in the order of the source,
+        parsed and validated in the pool, returns an
+        :class:`~yamo.importer.ImportResult`.
+        """
+        return import_stream(cls, source, format=format, mode=mode,
+                             workers=workers, chunk_size=chunk_size,
+                             max_pending=max_pending, null=null,
+                             on_reject=on_reject)
 
+    @classmethod
+    def parallel_query(cls, filter=None, workers=4, partitions=None,
+                       executor='thread', batch_size=1000, callback=None,
+                       checkpoint=None):
+        """ Scan matching documents with a pool of workers
+
+        :param filter: same as collection.find
+        :param workers: size of the pool
+        :param partitions: number of key ranges, 4 * workers by default
+        :param executor: 'thread' or 'process', workers decode Documents
+        :param batch_size: documents per find call
+        :param callback: called with each batch of Documents, in the
+                         workers, instead of returning them
+        :param checkpoint: a :class:`~yamo.parallel.Checkpoint` to record
+                           progress into, and resume from
+
+        Ranges are split at sampled values of `_id`, or of the first field
+        of a ranged ShardKey. Returns an iterator of Documents in no
+        particular order, or the number of documents given to callback.
+
+        >>> for post in Post.parallel_query({'lang': 'en'}, workers=8):
+        ...     handle(post)
+        >>> Post.parallel_query(callback=handle_batch, executor='process',
+        ...                     checkpoint=Checkpoint('reindex'))
+        """
+        return parallel_query(cls, filter, workers=workers,
+                              partitions=partitions, executor=executor,
+                              batch_size=batch_size, callback=callback,
+                              checkpoint=checkpoint)
+
+    @with_timeout
     def remove(self):
         _id = self._ensure_id()
         if _id:
-            self._coll.delete_one({'_id': _id})
+            session = current_session()
+            if session is not None:
+                return session.remove(self)
+            with deadlines.bounded(type(self)):
+                self._coll.delete_one(self._target_filter())
         else:
             log.warning("This document has no _id, it can't be deleted")
 
     @classmethod
-    def cached(cls, timeout=60, cache_none=False):
+    def cached(cls, timeout=60, cache_none=False, backend=None):
         """ Cache queries
 
         :param timeout: cache timeout
         :param cache_none: cache None result
+        :param backend: cache backend, e.g. `yamo.cache.SQLiteBackend`
 
         Usage::
 
         >>> Model.cached(60).query({...})
         """
-        return CachedModel(cls=cls, timeout=timeout, cache_none=cache_none)
+        return CachedModel(cls=cls, timeout=timeout, cache_none=cache_none,
+                           backend=backend)
+
+    @classmethod
+    def writer(cls, max_batch=1000, max_delay=1, max_queue=10000,
+               on_error=None):
+        """ Buffer writes and send them from a background thread
+
+        :param max_batch: max writes per bulk_write call
+        :param max_delay: max seconds a write is buffered
+        :param max_queue: callers block while this many writes are pending
+        :param on_error: callback(exception, operations) for failed writes
+
+        Usage::
+
+        >>> writer = Model.writer(max_delay=0.5)
+        >>> writer.save(doc)
+        >>> writer.update(doc, {'$inc': {'hits': 1}})
+        >>> writer.close()  # also done at exit
+        """
+        return WriteBehind(cls, max_batch=max_batch, max_delay=max_delay,
+                           max_queue=max_queue, on_error=on_error)
+
+    @classmethod
+    def mirror(cls, poll_interval=1, reload_interval=300):
+        """ Mirror the whole collection in memory
+
+        Meant for small, hot collections: once mirrored, query_one with
+        equality filters is answered locally.
+
+        Usage::
+
+        >>> Model.mirror()
+        >>> Model.query_one({'code': 'CN'})  # no round trip
+        >>> Model.mirror().stop()
+        """
+        mirror = Mirror.mirrors.get(cls)
+        if mirror is None:
+            mirror = Mirror(cls, poll_interval=poll_interval,
+                            reload_interval=reload_interval).start()
+        return mirror
 
-    def _pre_save(self):
+    def _pre_save(self, names=None):
         for name, field in self._fields.items():
+            if names is not None and name not in names:
+                continue
             value = field.pre_save_val(self._data.get(name))
             if value:
                 setattr(self, name, value)
@@ -271,21 +720,136 @@ class MapperMixin(object):
                     and self._data[name] is None:
                 del self._data[name]
 
+    def _validate_for_write(self, names=None):
+        """ validate before a write, as Meta.client_validation says
+
+        :param names: only validate these fields, None for all
+        """
+        mode = self.Meta._client_validation
+        if mode == 'full' or (mode == 'changed' and self._changed is None):
+            self.validate(names)
+        elif mode == 'changed':
+            changed = self._changed
+            if names is not None:
+                changed = [name for name in names if name in changed]
+            self.validate(changed)
+
+    def _save_op(self):
+        """ bulk_write operation equivalent to save() """
+        if '_id' in self._data:
+            doc = self._data.copy()
+            del doc['_id']
+            return operations.UpdateOne(self._target_filter(),
+                                        {'$set': doc}, upsert=True)
+        return operations.InsertOne(self._data)
+
+    def _upsert_op(self, null=False):
+        """ bulk_write operation equivalent to upsert(), None if no-op """
+        filter_ = self._upsert_filter()
+        if filter_:
+            update = self._upsert_update(filter_, null)
+            if update['$set']:
+                return operations.UpdateOne(filter_, update, upsert=True)
+        else:
+            return operations.InsertOne(self._data)
+
     def _upsert_filter(self):
-        filter_ = {}
-        if self._ensure_id():
-            filter_['_id'] = self._data['_id']
-        for name in self.unique_fields:
-            value = self._data.get(name)
-            if value:
-                filter_[name] = value
+        """ filter on the best fully populated unique key
+
+        `_id` if known or derivable by the IDFormatter, otherwise the
+        unique index with the fewest fields whose values are all set,
+        empty if there is none. Shard key values are added to both.
+        """
+        _id = self._ensure_id()
+        if _id is not None:
+            return self._target_filter()
+        for keys in self.Meta._unique_keys:
+            filter_ = {}
+            for key in keys:
+                value = self._data.get(key)
+                if value is None:
+                    break
+                filter_[key] = value
+            else:
+                return self._target_filter(filter_=filter_)
+        return {}
+
+    def _target_filter(self, data=None, filter_=None):
+        """ filter on _id, and on the shard key so mongos targets one shard
+
+        :param data: take values from this dict instead of _data
+        :param filter_: filter to add the shard key to, `{'_id': ...}`
+                        by default
+        """
+        if data is None:
+            data = self._data
+        if filter_ is None:
+            filter_ = {'_id': data['_id']}
+        shardkey = self.Meta._shardkey
+        if shardkey is not None:
+            for key in shardkey.key:
+                if key not in filter_:
+                    value = get_path(data, key)
+                    if value is not None:
+                        filter_[key] = value
         return filter_
 
+    @classmethod
+    def _shard_order(cls, docs):
+        """ docs sorted by shard key values, or grouped if not sortable """
+        shardkey = cls.Meta._shardkey
+        if shardkey is None:
+            return docs
+
+        def values(doc):
+            return tuple(get_path(getattr(doc, '_data', {}), key)
+                         for key in shardkey.key)
+
+        if 'hashed' not in shardkey.key.values():
+            # ranged keys: neighbours are likely in the same chunk
+            try:
+                return sorted(docs, key=values)
+            except TypeError:
+                pass
+        groups = OrderedDict()
+        for doc in docs:
+            groups.setdefault(repr(values(doc)), []).append(doc)
+        return [doc for group in groups.values() for doc in group]
+
+    @classmethod
+    def _check_targeted(cls, filter):
+        """ warn about a query sent to all shards """
+        shardkey = cls.Meta._shardkey
+        if shardkey is None:
+            return
+        if filter is not None and not isinstance(filter, dict):
+            # find_one(<_id>)
+            filter = {'_id': filter}
+        key, kind = next(iter(shardkey.key.items()))
+        shape = explain.filter_shape(filter)
+        equality, ranges = shape
+        if key in equality or (key in ranges and kind != 'hashed'):
+            return
+        metrics.incr('scatter_gather', cls, filter=filter)
+        if (cls, shape) not in UNTARGETED:
+            UNTARGETED.add((cls, shape))
+            log.warning('query on {} can not be targeted by shard key {}: '
+                        '{}'.format(cls.__name__, list(shardkey.key), filter))
+
+    def _insert_doc(self, null=False):
+        """ document inserted by upsert(), when it is new """
+        return {key: value for key, value in self._data.items()
+                if null or value is not None or key == '_id'}
+
     def _upsert_update(self, filter_, null=False):
+        shardkey = self.Meta._shardkey
+        # shard key values are only in the filter for targeting
+        keep = set(shardkey.key) if shardkey is not None else ()
         to_update = {}
         to_insert = {}
         for key, value in self._data.items():
-            if key not in filter_ and (null or value is not None):
+            if (key not in filter_ or key in keep) and \
+                    (null or value is not None):
                 if self._defaults.get(key) == value:
                     # default value should only been applied if it is an insert
                     to_insert[key] = value
@@ -299,12 +863,9 @@ class MapperMixin(object):
     def _ensure_id(self):
         _id = self._data.get('_id')
         if not _id and self.Meta._formatter:
-            try:
-                _id = self.Meta._formatter._format(**self._data)
-            except KeyError:
-                pass
-            else:
-                self._data['_id'] = _id
+            formatted = self.Meta._formatter.format_id(self._data)
+            if formatted is not None:
+                _id = self._data['_id'] = formatted
         return _id
 
 
@@ -318,8 +879,27 @@ class Document(InitMixin, ValidationMixin, MetaMixin, MapperMixin, MongoOperatio
 
     @classmethod
     def from_storage(cls, data):
+        session = current_session()
+        if session is not None:
+            instance = session.get(cls, data.get('_id'))
+            if instance is not None:
+                return instance
+
+        instance = cls._from_data(data)
+        if session is not None:
+            session.track(instance)
+        return instance
+
+    @classmethod
+    def _from_data(cls, data, changed=()):
+        """ instance holding data, outside of any session
+
+        :param changed: names assigned since loaded, None for a new
+                        Document
+        """
         instance = cls()
         instance._data = data
+        instance._changed = None if changed is None else set(changed)
         # create reference to embedded values
         for key, value in instance._fields.items():
             if isinstance(value, EmbeddedField):
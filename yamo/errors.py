@@ -14,6 +14,7 @@ class IncompleteDocumentData(Exception):
 class ArgumentError(Exception):
 
     def __init__(self, obj, val):
+        super(ArgumentError, self).__init__(obj, val)
         self.obj = obj
         self.val = val
 
@@ -25,6 +26,7 @@ class ArgumentError(Exception):
 class ValidationError(YamoException):
 
     def __init__(self, cls, attr, val):
+        super(ValidationError, self).__init__(cls, attr, val)
         self.cls = cls
         self.attr = attr
         self.val = val
@@ -38,9 +40,48 @@ class ValidationError(YamoException):
 class DeserializationError(YamoException):
 
     def __init__(self, field, val):
+        super(DeserializationError, self).__init__(field, val)
         self.fld = field
         self.val = val
 
     def __str__(self):
         msg = "Can't deserialize value for field {}: {}"
         return msg.format(self.fld, self.val)
+
+
+class DocumentNotFound(YamoException):
+
+    def __init__(self, cls, ids):
+        super(DocumentNotFound, self).__init__(cls, ids)
+        self.cls = cls
+        self.ids = ids
+
+    def __str__(self):
+        return "{} not found with _id in {}".format(self.cls, self.ids)
+
+
+class BatchValidationError(ValidationError):
+
+    """ every failure of a batch, as (document index, field name, value)
+    tuples, the first one is also in cls, attr and val
+    """
+
+    def __init__(self, cls, failures):
+        YamoException.__init__(self, cls, failures)
+        self.cls = cls
+        self.failures = failures
+        _, self.attr, self.val = failures[0]
+
+    def __str__(self):
+        return "Validation failed on {}: {} failures, first {}" \
+            "".format(self.cls, len(self.failures), self.failures[0])
+
+
+class DeadlineExceeded(YamoException):
+
+    def __init__(self, cls):
+        super(DeadlineExceeded, self).__init__(cls)
+        self.cls = cls
+
+    def __str__(self):
+        return "Deadline exceeded on {}".format(self.cls)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import logging
+import threading
+from collections.abc import Mapping
+
+log = logging.getLogger('yamo')
+
+# operators matching a single value, the "E" of ESR
+EQUALITY_OPS = set(['$eq', '$in'])
+
+# the active PlanRecorder, see start()
+recorder = None
+
+
+def filter_shape(filter):
+    """ (equality fields, range fields) of a filter, both sorted """
+    equality = set()
+    ranges = set()
+    conds = [filter or {}]
+    while conds:
+        cond = conds.pop()
+        for key, value in cond.items():
+            if key == '$and':
+                conds.extend(value)
+            elif key.startswith('$'):
+                # $or, $text, $where... can't be served by one index
+                ranges.add(key)
+            elif isinstance(value, Mapping) and value and \
+                    all(op.startswith('$') for op in value):
+                if set(value) <= EQUALITY_OPS:
+                    equality.add(key)
+                else:
+                    ranges.add(key)
+            else:
+                equality.add(key)
+    return tuple(sorted(equality)), tuple(sorted(ranges - equality))
+
+
+def normalize_sort(sort):
+    """ sort argument of find as a tuple of (key, direction) """
+    if not sort:
+        return ()
+    if isinstance(sort, str):
+        return ((sort, 1),)
+    return tuple((k, 1) if isinstance(k, str) else tuple(k) for k in sort)
+
+
+def plan_stages(plan):
+    """ yield every stage of an explain plan tree """
+    if isinstance(plan, Mapping):
+        if 'stage' in plan:
+            yield plan
+        for value in plan.values():
+            if isinstance(value, (Mapping, list)):
+                for stage in plan_stages(value):
+                    yield stage
+    elif isinstance(plan, list):
+        for value in plan:
+            for stage in plan_stages(value):
+                yield stage
+
+
+def suggest_index(shape):
+    """ index keys for a shape: equality, then sort, then range fields """
+    equality, sort, ranges = shape
+    keys = [(key, 1) for key in equality]
+    keys += [(key, d) for key, d in sort if key not in equality]
+    keys += [(key, 1) for key in ranges
+             if not key.startswith('$') and key not in dict(keys)]
+    return keys
+
+
+class PlanRecorder(object):
+
+    """ Explain queries sent by Model.query and Model.query_one
+
+    Meant for development and tests, see :func:`start`. Each filter
+    shape (fields compared by equality, sort, fields compared by range)
+    is explained once per Document class, and calls are counted.
+
+    :param sample_rate: fraction of the queries to look at
+    """
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        # cls -> shape -> {'count': n, 'uncovered': bool}
+        self.shapes = {}
+        # cls -> set of used index keys, as tuples of (key, direction)
+        self.used = {}
+
+    def sample(self, cls, filter=None, sort=None):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if filter is not None and not isinstance(filter, Mapping):
+            # find_one(<_id>)
+            filter = {'_id': filter}
+        shape = filter_shape(filter)
+        sort = normalize_sort(sort)
+        shape = (shape[0], sort, shape[1])
+
+        with self.lock:
+            shapes = self.shapes.setdefault(cls, {})
+            stats = shapes.get(shape)
+            if stats is not None:
+                stats['count'] += 1
+                return
+            stats = shapes[shape] = {'count': 1, 'uncovered': False}
+
+        try:
+            plan = cls._coll.find(filter, sort=list(sort) or None).explain()
+        except Exception:
+            log.debug('explain of {} failed'.format(cls.__name__),
+                      exc_info=True)
+            return
+        self._record(cls, stats, plan.get('queryPlanner', plan))
+
+    def _record(self, cls, stats, planner):
+        used = self.used.setdefault(cls, set())
+        for stage in plan_stages(planner.get('winningPlan', {})):
+            if stage['stage'] in ('COLLSCAN', 'SORT'):
+                # full scan, or sorted in memory
+                stats['uncovered'] = True
+            elif 'keyPattern' in stage:
+                # directions may come back as floats
+                used.add(tuple(
+                    (k, int(d) if isinstance(d, float) else d)
+                    for k, d in stage['keyPattern'].items()))
+
+    def report(self):
+        """ Suggested and unused indexes per Document class name
+
+        >>> explain.report()
+        {'Post': {'queries': 120,
+                  'uncovered': [{'filter': (('author',), (), ('ts',)),
+                                 'count': 40,
+                                 'suggest': [('author', 1), ('ts', 1)]}],
+                  'unused': [[('tag', 1)]]}}
+
+        Unique and TTL indexes are never reported as unused, they are
+        not meant for queries only.
+        """
+        report = {}
+        with self.lock:
+            shapes = {cls: dict(s) for cls, s in self.shapes.items()}
+        for cls, cls_shapes in shapes.items():
+            uncovered = [
+                {'filter': shape, 'count': stats['count'],
+                 'suggest': suggest_index(shape)}
+                for shape, stats in cls_shapes.items()
+                # scanning everything is expected without filter and sort
+                if stats['uncovered'] and any(shape)]
+            uncovered.sort(key=lambda u: -u['count'])
+            used = self.used.get(cls, set())
+            unused = [idx.keys for idx in cls.Meta._indexes
+                      if tuple(idx.keys) not in used and
+                      not idx.kwargs.get('unique') and
+                      'expireAfterSeconds' not in idx.kwargs]
+            report[cls.__name__] = {
+                'queries': sum(s['count'] for s in cls_shapes.values()),
+                'uncovered': uncovered,
+                'unused': unused,
+            }
+        return report
+
+
+def start(sample_rate=1.0):
+    """ start explaining queries, e.g. in a test suite setup
+
+    >>> from yamo import explain
+    >>> explain.start()
+    >>> run_tests()
+    >>> explain.stop().report()
+    """
+    global recorder
+    recorder = PlanRecorder(sample_rate)
+    return recorder
+
+
+def stop():
+    """ stop explaining queries, return the recorder """
+    global recorder
+    stopped, recorder = recorder, None
+    return stopped
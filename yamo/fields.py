@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 import re
 import weakref
+import threading
+from collections import OrderedDict
 from enum import Enum
 from datetime import datetime
 
-from bson import ObjectId
-
+from . import deadlines
 from .errors import ValidationError, DeserializationError, ArgumentError
+from .lazy import lazy_import
+
+bson = lazy_import('bson')
+lzma = lazy_import('lzma')
+zlib = lazy_import('zlib')
 
 
 # MongoDB will not store dates with milliseconds.
@@ -20,6 +26,8 @@ class BaseField(object):
 
     """ Base field for all fields. """
     types = []
+    # BSON type aliases of `types`, used in $jsonSchema
+    bson_types = []
 
     def __init__(self, default=None, required=False,
                  nullable=False, name=None):
@@ -44,6 +52,86 @@ class BaseField(object):
                 else:
                     self._raise_validation_error(value)
 
+    def validate_storage(self, value):
+        """ validate() of a value as stored in _data """
+        self.validate(self.to_python(value))
+
+    def compile_check(self):
+        """ function(values) -> indexes of the values failing validate()
+
+        Values are storage values, as in _data. Used to validate a batch
+        of Documents one field at a time, see Document.validate_batch.
+        Fields whose to_python or validate differ from the ones a check
+        was written for are checked one value at a time.
+        """
+        if not self._fast(BaseField):
+            return self._slow_check()
+        return self._make_check(self._type_check())
+
+    def _fast(self, cls):
+        """ whether validate() is the one of cls, and to_python a no-op """
+        return type(self).validate is cls.validate and \
+            type(self).to_python is BaseField.to_python
+
+    def _type_check(self):
+        """ ok(value) of BaseField.validate, None if it checks nothing """
+        if not self.required or self.nullable:
+            return None
+        types = tuple(self.types)
+        if types:
+            return lambda v: v is not None and isinstance(v, types)
+        return lambda v: v is not None
+
+    @staticmethod
+    def _make_check(ok):
+        if ok is None:
+            return lambda values: []
+
+        def check(values):
+            bad = []
+            for i, v in enumerate(values):
+                try:
+                    if not ok(v):
+                        bad.append(i)
+                except TypeError:
+                    # e.g. comparing an unchecked type to a bound
+                    bad.append(i)
+            return bad
+        return check
+
+    def _slow_check(self):
+        validate_storage = self.validate_storage
+
+        def check(values):
+            bad = []
+            for i, v in enumerate(values):
+                try:
+                    validate_storage(v)
+                except Exception:
+                    bad.append(i)
+            return bad
+        return check
+
+    def json_schema(self):
+        """ $jsonSchema of the values accepted by validate()
+
+        Like validate(), the type is only checked for required and not
+        nullable fields.
+        """
+        schema = {}
+        if self.required and not self.nullable and self.bson_types:
+            schema['bsonType'] = list(self.bson_types)
+        return schema
+
+    @staticmethod
+    def _bounds_schema(schema, bounds, empty):
+        """ add bounds to schema, but like validate(), not for the falsy
+        value empty
+        """
+        if bounds:
+            schema['anyOf'] = [bounds, {'enum': [empty]}]
+        return schema
+
     def pre_save_val(self, value):
         """ do something to field value before save """
         return None
@@ -58,12 +146,128 @@ class BaseField(object):
 AnyField = BaseField
 
 
+# compressed values are stored as BSON binary of this user defined subtype,
+# the first byte of the payload tells the compression method
+COMPRESSED_SUBTYPE = 0x80
+COMPRESSORS = {
+    'zlib': (1, zlib),
+    'lzma': (2, lzma),
+}
+DECOMPRESSORS = {
+    1: zlib,
+    2: lzma,
+}
+# decoded compressed values kept per field
+DECODED_CACHE_SIZE = 64
+
+
+class CompressibleField(BaseField):
+
+    """ Field whose large values can be compressed in storage
+
+    :param compress: 'zlib' or 'lzma', None to store values as they are
+    :param compress_threshold: only values whose encoded size reaches
+                               this many bytes are compressed
+
+    Values are decompressed on access only, the recently accessed ones
+    are kept decoded, so assign the field again after modifying a value
+    in place. Only valid values are compressed, invalid ones are stored
+    as they are and fail validation on save. Compressed values loaded
+    from the database are not validated again, like the server schema
+    accepts any compressed payload.
+    """
+
+    def __init__(self, compress=None, compress_threshold=1024, **kwargs):
+        if compress is not None and compress not in COMPRESSORS:
+            raise ArgumentError(self.__class__, compress)
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        # id(compressed value) -> (compressed value, decoded value)
+        self._decoded = OrderedDict()
+        self._decoded_lock = threading.Lock()
+        super(CompressibleField, self).__init__(**kwargs)
+
+    def json_schema(self):
+        schema = super(CompressibleField, self).json_schema()
+        if self.compress and 'bsonType' in schema:
+            schema['bsonType'].append('binData')
+        return schema
+
+    def _compress(self, raw, value):
+        """ compressed Binary for raw bytes, None if not worth it or if
+        value, the python value, is invalid
+
+        Compressed values are valid, so validate_storage does not need to
+        decompress them.
+        """
+        if self.compress and len(raw) >= self.compress_threshold:
+            try:
+                self.validate(value)
+            except Exception:
+                return None
+            method, module = COMPRESSORS[self.compress]
+            payload = bytes([method]) + module.compress(raw)
+            if len(payload) < len(raw):
+                return bson.Binary(payload, COMPRESSED_SUBTYPE)
+
+    def validate_storage(self, value):
+        if self._is_compressed(value):
+            return
+        super(CompressibleField, self).validate_storage(value)
+
+    @staticmethod
+    def _is_compressed(value):
+        return isinstance(value, bson.Binary) and \
+            value.subtype == COMPRESSED_SUBTYPE
+
+    def _decompress(self, value):
+        try:
+            return DECOMPRESSORS[value[0]].decompress(bytes(value[1:]))
+        except (KeyError, IndexError, zlib.error, lzma.LZMAError):
+            raise DeserializationError(self, value[:16])
+
+    def _compress_value(self, value, python):
+        """ compress a BSON encodable value, the storage form of python """
+        if self.compress and value:
+            compressed = self._compress(bson.BSON.encode({'v': value}),
+                                        python)
+            if compressed is not None:
+                return compressed
+        return value
+
+    def _decompress_value(self, value):
+        if self._is_compressed(value):
+            return self._cached(value, lambda v: bson.BSON(
+                self._decompress(v)).decode()['v'])
+        return value
+
+    def _cached(self, value, decode):
+        """ decode(value) of a compressed value, cached by identity """
+        key = id(value)
+        with self._decoded_lock:
+            hit = self._decoded.get(key)
+            if hit is not None and hit[0] is value:
+                self._decoded.move_to_end(key)
+                return hit[1]
+        decoded = decode(value)
+        with self._decoded_lock:
+            self._decoded[key] = (value, decoded)
+            while len(self._decoded) > DECODED_CACHE_SIZE:
+                self._decoded.popitem(last=False)
+        return decoded
+
+
 class ObjectIdField(BaseField):
-    types = [ObjectId]
+    bson_types = ['objectId']
+
+    @property
+    def types(self):
+        return [bson.ObjectId]
 
 
 class IntField(BaseField):
     types = [int]
+    bson_types = ['int', 'long']
 
     def __init__(self, min=None, max=None, **kwargs):
         self._min = min
@@ -78,6 +282,29 @@ class IntField(BaseField):
                     (self._max and self._max < value):
                 self._raise_validation_error(value)
 
+    def compile_check(self):
+        if not self._fast(IntField):
+            return super(IntField, self).compile_check()
+        type_ok = self._type_check()
+        min_, max_ = self._min, self._max
+        if not (min_ or max_):
+            return self._make_check(type_ok)
+
+        def ok(v):
+            if type_ok is not None and not type_ok(v):
+                return False
+            return not (v and ((min_ and min_ > v) or (max_ and max_ < v)))
+        return self._make_check(ok)
+
+    def json_schema(self):
+        schema = super(IntField, self).json_schema()
+        bounds = {}
+        if self._min:
+            bounds['minimum'] = self._min
+        if self._max:
+            bounds['maximum'] = self._max
+        return self._bounds_schema(schema, bounds, 0)
+
 
 class EnumField(BaseField):
     types = [Enum]
@@ -93,6 +320,13 @@ class EnumField(BaseField):
             if not isinstance(value, self._cls):
                 self._raise_validation_error(value)
 
+    def json_schema(self):
+        schema = super(EnumField, self).json_schema()
+        schema['enum'] = [self.to_storage(e) for e in self._cls]
+        if not (self.required and not self.nullable):
+            schema['enum'].append(None)
+        return schema
+
     def to_python(self, value):
         return self._cls(value)
 
@@ -105,14 +339,17 @@ class EnumField(BaseField):
 
 class BooleanField(BaseField):
     types = [bool]
+    bson_types = ['bool']
 
 
 class FloatField(BaseField):
     types = [float, int]
+    bson_types = ['double', 'int', 'long']
 
 
-class BinaryField(BaseField):
+class BinaryField(CompressibleField):
     types = [bytes]
+    bson_types = ['binData']
 
     def __init__(self, min_bytes=None, max_bytes=None, **kwargs):
         self.min_bytes = min_bytes
@@ -126,9 +363,22 @@ class BinaryField(BaseField):
                     (self.max_bytes and len(value) > self.max_bytes):
                 self._raise_validation_error(value)
 
+    def to_storage(self, value):
+        if self.compress and value:
+            compressed = self._compress(value, value)
+            if compressed is not None:
+                return compressed
+        return value
+
+    def to_python(self, value):
+        if self._is_compressed(value):
+            return self._cached(value, self._decompress)
+        return value
+
 
 class StringField(BaseField):
     types = [str]
+    bson_types = ['string']
 
     def __init__(self, min_length=None, max_length=None, strip=True, **kwargs):
         self.min_length = min_length
@@ -143,6 +393,36 @@ class StringField(BaseField):
                     (self.max_length and len(value) > self.max_length):
                 self._raise_validation_error(value)
 
+    def compile_check(self):
+        if not self._fast(StringField):
+            return super(StringField, self).compile_check()
+        return self._make_check(self._string_ok())
+
+    def _string_ok(self):
+        type_ok = self._type_check()
+        min_, max_ = self.min_length, self.max_length
+        if not (min_ or max_):
+            return type_ok
+
+        def ok(v):
+            if type_ok is not None and not type_ok(v):
+                return False
+            return not (v and ((min_ and len(v) < min_) or
+                               (max_ and len(v) > max_)))
+        return ok
+
+    def json_schema(self):
+        schema = super(StringField, self).json_schema()
+        return self._bounds_schema(schema, self._length_bounds(), '')
+
+    def _length_bounds(self):
+        bounds = {}
+        if self.min_length:
+            bounds['minLength'] = self.min_length
+        if self.max_length:
+            bounds['maxLength'] = self.max_length
+        return bounds
+
     def to_storage(self, value):
         if self.strip and value:
             value = str(value).strip()
@@ -162,9 +442,29 @@ class EmailField(StringField):
         if value and not self.email_re.match(value):
             self._raise_validation_error(value)
 
+    def compile_check(self):
+        if not self._fast(EmailField):
+            return super(EmailField, self).compile_check()
+        string_ok = self._string_ok()
+        match = self.email_re.match
+
+        def ok(v):
+            if string_ok is not None and not string_ok(v):
+                return False
+            return not v or match(v) is not None
+        return self._make_check(ok)
+
+    def json_schema(self):
+        schema = super(StringField, self).json_schema()
+        bounds = self._length_bounds()
+        bounds['pattern'] = self.email_re.pattern
+        return self._bounds_schema(schema, bounds, '')
+
 
 class DateTimeField(BaseField):
     types = [datetime]
+    # strings are parsed by to_python, and stored as they are
+    bson_types = ['date', 'string']
 
     def __init__(self, modified=False, created=False, **kwargs):
 
@@ -201,8 +501,9 @@ class DateTimeField(BaseField):
         return value
 
 
-class DictField(BaseField):
+class DictField(CompressibleField):
     types = [dict]
+    bson_types = ['object']
 
     def __init__(self, default=None, **kwargs):
         default = default or {}
@@ -214,12 +515,14 @@ class DictField(BaseField):
             if isinstance(k, str):
                 k = k.replace('.', '__dot__')
             escaped[k] = v
-        return escaped
+        return self._compress_value(escaped, value)
 
     def to_python(self, value):
         if value is None:
             return {}
 
+        value = self._decompress_value(value)
+
         if not isinstance(value, dict):
             raise DeserializationError(self, value)
 
@@ -231,8 +534,9 @@ class DictField(BaseField):
         return unescaped
 
 
-class ListField(BaseField):
+class ListField(CompressibleField):
     types = [list]
+    bson_types = ['array']
 
     def __init__(self, field=None, default=None, **kwargs):
         default = default or []
@@ -251,16 +555,27 @@ class ListField(BaseField):
             for v in value:
                 self.field.validate(v)
 
+    def json_schema(self):
+        schema = super(ListField, self).json_schema()
+        if self.field:
+            # only applies to arrays, not to compressed values
+            items = self.field.json_schema()
+            if items:
+                schema['items'] = items
+        return schema
+
     def to_storage(self, value):
+        stored = value
         if self.field:
-            return [self.field.to_storage(v) for v in value]
-        else:
-            return value
+            stored = [self.field.to_storage(v) for v in value]
+        return self._compress_value(stored, value)
 
     def to_python(self, value):
         if value is None:
             return []
 
+        value = self._decompress_value(value)
+
         if not isinstance(value, list):
             raise DeserializationError(self, value)
 
@@ -270,6 +585,81 @@ class ListField(BaseField):
             return value
 
 
+class ArrayField(BaseField):
+
+    """ NumPy ndarray field
+
+    :param dtype: numpy dtype of the array
+    :param shape: expected shape, None for any shape, or a tuple in which
+                  None matches any length on that axis
+    :param min: minimum value of all items
+    :param max: maximum value of all items
+
+    Stored as {'dtype': ..., 'shape': [...], 'data': <binary>}, loaded
+    with numpy.frombuffer without copying, so loaded arrays are read-only.
+    Assigned arrays are only converted to dtype when numpy can cast them
+    safely, other ones raise ValidationError.
+    """
+
+    def __init__(self, dtype, shape=None, min=None, max=None, **kwargs):
+        self.dtype = dtype
+        self.shape = tuple(shape) if shape is not None else None
+        self._min = min
+        self._max = max
+        super(ArrayField, self).__init__(**kwargs)
+
+    def validate(self, value):
+        import numpy
+        super(ArrayField, self).validate(value)
+
+        if value is None:
+            return
+        if not isinstance(value, numpy.ndarray) or \
+                value.dtype != numpy.dtype(self.dtype):
+            self._raise_validation_error(value)
+        if self.shape is not None:
+            if len(self.shape) != value.ndim or \
+                    any(s is not None and s != v
+                        for s, v in zip(self.shape, value.shape)):
+                self._raise_validation_error(value)
+        if value.size:
+            if (self._min is not None and value.min() < self._min) or \
+                    (self._max is not None and value.max() > self._max):
+                self._raise_validation_error(value)
+
+    def json_schema(self):
+        # validate() checks the type of any value, None aside
+        schema = {'bsonType': ['object'],
+                  'properties': {'dtype': {'bsonType': 'string'},
+                                 'shape': {'bsonType': 'array'},
+                                 'data': {'bsonType': 'binData'}}}
+        if not self.required or self.nullable:
+            schema['bsonType'].append('null')
+        return schema
+
+    def to_storage(self, value):
+        if value is None or isinstance(value, dict):
+            return value
+        import numpy
+        array = numpy.asarray(value)
+        if not numpy.can_cast(array.dtype, self.dtype, casting='safe'):
+            self._raise_validation_error(value)
+        array = numpy.ascontiguousarray(array, dtype=self.dtype)
+        return {'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'data': array.tobytes()}
+
+    def to_python(self, value):
+        if not isinstance(value, dict):
+            return value
+        import numpy
+        try:
+            array = numpy.frombuffer(value['data'], dtype=value['dtype'])
+            return array.reshape(value['shape'])
+        except (KeyError, TypeError, ValueError):
+            raise DeserializationError(self, value)
+
+
 class EmbeddedField(BaseField):
 
     def __init__(self, embedded, **kwargs):
@@ -290,6 +680,12 @@ class EmbeddedField(BaseField):
             else:
                 value.validate()
 
+    def json_schema(self):
+        schema = self.embedded.json_schema()
+        if not self.required or self.nullable:
+            schema['bsonType'] = ['object', 'null']
+        return schema
+
     def to_storage(self, value):
         if isinstance(value, self.embedded):
             value = value._data
@@ -339,6 +735,8 @@ class SequenceField(IntField):
                     update={'$inc': {'seq': 1}},
                     new=True, upsert=True)
             except:
+                # 不能超过当前的 deadline
+                deadlines.check(self._doc)
                 count -= 1
                 # 最多尝试100次, 还不行应该是哪里有问题了
                 if count < 0:
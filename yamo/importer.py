@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Parallel streaming import of JSONL/CSV rows into a Document collection
+
+Usage::
+
+    $ yamo-import myapp.models:Post posts.jsonl --uri mongodb://host/db
+
+or from python::
+
+    >>> result = Post.import_stream('posts.csv', format='csv')
+    >>> result.written, result.rejected
+"""
+import os
+import csv
+import sys
+import json
+import importlib
+from collections import deque
+
+from .errors import ArgumentError
+from .fields import (IntField, FloatField, BooleanField, DateTimeField,
+                     SequenceField)
+from .lazy import lazy_import
+
+operations = lazy_import('pymongo.operations')
+errors = lazy_import('pymongo.errors')
+
+TRUE_STRINGS = set(['1', 'true', 'yes', 'y', 't', 'on'])
+
+
+class ImportResult(object):
+
+    """ Outcome of an import
+
+    `rejected` holds (line number, row, error) of every row that failed
+    to parse, validate or write, unless an `on_reject` callback was
+    given. `written` counts the rows written.
+    """
+
+    def __init__(self):
+        self.accepted = 0
+        self.written = 0
+        self.rejected = []
+
+    def __repr__(self):
+        return '<ImportResult accepted={} written={} rejected={}>'.format(
+            self.accepted, self.written, len(self.rejected))
+
+
+def coerce(field, value):
+    """ convert a CSV string or JSON value to what the field expects """
+    if isinstance(value, str):
+        if value == '' and not isinstance(field, DateTimeField):
+            return None
+        if isinstance(field, BooleanField):
+            return value.strip().lower() in TRUE_STRINGS
+        if isinstance(field, IntField):
+            return int(value)
+        if isinstance(field, FloatField):
+            return float(value)
+    if isinstance(field, DateTimeField):
+        return field.to_python(value or None)
+    return value
+
+
+def remote_fields(cls):
+    """ names of the fields whose pre_save needs a round trip to the
+    server, left to the importing process
+    """
+    return [name for name, field in cls._fields.items()
+            if isinstance(field, SequenceField)]
+
+
+def parse_row(cls, format, raw):
+    if format == 'jsonl':
+        row = json.loads(raw)
+        if not isinstance(row, dict):
+            raise ArgumentError(parse_row, raw)
+    else:
+        row = raw
+    data = {}
+    for name, value in row.items():
+        field = cls._fields.get(name)
+        data[name] = coerce(field, value) if field else value
+    # cls({}) would be left without defaults
+    doc = cls()
+    doc._fill(data)
+    # in the same order as save(): pre_save values are validated too
+    remote = remote_fields(cls)
+    local = [name for name in cls._fields if name not in remote]
+    doc._pre_save(local)
+    doc._validate_for_write(local)
+    return doc._data, doc._defaults
+
+
+def process_chunk(cls, format, chunk):
+    """ parse and validate a chunk of rows, runs in a worker process
+
+    Returns (accepted, rejected), accepted rows as (line number, raw row,
+    data, defaults), rejected ones as (line number, raw row, error).
+    """
+    accepted = []
+    rejected = []
+    for lineno, raw in chunk:
+        try:
+            accepted.append((lineno, raw) + parse_row(cls, format, raw))
+        except Exception as e:
+            rejected.append((lineno, raw, e))
+    return accepted, rejected
+
+
+def read_rows(source, format):
+    """ yield (line number, raw row) from a path or an iterable of lines """
+    if isinstance(source, str):
+        with open(source, newline='' if format == 'csv' else None) as f:
+            for row in read_rows(f, format):
+                yield row
+        return
+
+    if format == 'csv':
+        reader = csv.DictReader(source)
+        for row in reader:
+            # values of columns missing from the header
+            row.pop(None, None)
+            yield reader.line_num, row
+    else:
+        for lineno, line in enumerate(source, 1):
+            if line.strip():
+                yield lineno, line
+
+
+def chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_stream(cls, source, format='jsonl', mode='upsert', workers=None,
+                  chunk_size=1000, max_pending=None, null=False,
+                  on_reject=None):
+    """ see Model.import_stream """
+    if format not in ('jsonl', 'csv'):
+        raise ArgumentError(import_stream, format)
+    if mode not in ('upsert', 'insert'):
+        raise ArgumentError(import_stream, mode)
+
+    result = ImportResult()
+    remote = remote_fields(cls)
+
+    def reject(lineno, raw, error):
+        if on_reject is not None:
+            on_reject(lineno, raw, error)
+        else:
+            result.rejected.append((lineno, raw, error))
+
+    def write(outcome):
+        accepted, rejected = outcome
+        for lineno, raw, error in rejected:
+            reject(lineno, raw, error)
+
+        requests = []
+        # (line number, raw row) of each request
+        sources = []
+        for lineno, raw, data, defaults in accepted:
+            doc = cls()
+            doc._data = data
+            doc._defaults = defaults
+            if remote:
+                try:
+                    doc._pre_save(remote)
+                    doc._validate_for_write(remote)
+                except Exception as e:
+                    reject(lineno, raw, e)
+                    continue
+            result.accepted += 1
+            if mode == 'insert':
+                requests.append(operations.InsertOne(doc._data))
+            else:
+                op = doc._upsert_op(null)
+                if op is None:
+                    continue
+                requests.append(op)
+            sources.append((lineno, raw))
+        if not requests:
+            return
+        try:
+            cls._coll.bulk_write(requests, ordered=False)
+        except errors.BulkWriteError as e:
+            failed = e.details.get('writeErrors') or []
+            if not failed:
+                raise
+            # e.g. duplicate keys in insert mode
+            for err in failed:
+                lineno, raw = sources[err['index']]
+                reject(lineno, raw, errors.WriteError(
+                    err.get('errmsg'), err.get('code'), err))
+            result.written += len(requests) - len(failed)
+        else:
+            result.written += len(requests)
+
+    rows = chunks(read_rows(source, format), chunk_size)
+    if workers == 0:
+        for chunk in rows:
+            write(process_chunk(cls, format, chunk))
+        return result
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    # bound the chunks in flight, so memory stays constant, and write
+    # them in the order they were read
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in rows:
+            pending.append(executor.submit(process_chunk, cls, format,
+                                           chunk))
+            if len(pending) >= max_pending:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    return result
+
+
+def main(argv=None):
+    import argparse
+    from .connection import Connection
+
+    parser = argparse.ArgumentParser(
+        description='Import JSONL/CSV rows into a yamo Document collection')
+    parser.add_argument('document', help='module.path:DocumentClass')
+    parser.add_argument('source', help='file to import, - for stdin')
+    parser.add_argument('--format', choices=['jsonl', 'csv'])
+    parser.add_argument('--mode', choices=['upsert', 'insert'],
+                        default='upsert')
+    parser.add_argument('--uri', default='mongodb://localhost/test')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    module, name = args.document.split(':')
+    cls = getattr(importlib.import_module(module), name)
+    Connection(args.uri).register(cls)
+
+    format = args.format or \
+        ('csv' if args.source.endswith('.csv') else 'jsonl')
+    source = sys.stdin if args.source == '-' else args.source
+
+    def on_reject(lineno, row, error):
+        print('{}\t{}'.format(lineno, error), file=sys.stderr)
+
+    result = import_stream(cls, source, format=format, mode=args.mode,
+                           workers=args.workers, chunk_size=args.chunk_size,
+                           on_reject=on_reject)
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+
+    """ Placeholder for a module imported on first attribute access
+
+    Keeps `import yamo` free of the driver (pymongo, bson) until a real
+    operation needs it.
+
+    >>> operations = LazyModule('pymongo.operations')
+    >>> operations.UpdateOne  # pymongo is imported here
+    """
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        # later lookups hit the instance dict directly
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import re
+import string
 import logging
 from collections import OrderedDict
 
 from .fields import BaseField
-from .errors import ArgumentError
+from .errors import ArgumentError, ConfigError
 from .connection import Connection
 
 log = logging.getLogger('yamo')
 
+CLIENT_VALIDATION = ('off', 'changed', 'full')
+
 
 class EmbeddedDocumentType(type):
 
@@ -29,6 +33,8 @@ class EmbeddedDocumentType(type):
     def set_maker(attr):
         def setter(self, val=None, attr=attr):
             self._data[attr] = self._fields[attr].to_storage(val)
+            if self._changed is not None:
+                self._changed.add(attr)
 
         return setter
 
@@ -76,6 +82,8 @@ class DocumentType(EmbeddedDocumentType):
             val._indexes = []
             val._shardkey = None
             val._formatter = None
+            val._bucket = None
+            val._view = None
             for k, v in val.__dict__.items():
                 if k not in ['__weakref__', '__doc__',
                              '__dict__', '__module__']:
@@ -85,6 +93,34 @@ class DocumentType(EmbeddedDocumentType):
                         val._shardkey = v
                     elif isinstance(v, IDFormatter):
                         val._formatter = v
+                    elif isinstance(v, Bucket):
+                        val._bucket = v
+                    elif isinstance(v, View):
+                        val._view = v
+
+            # upsert key plan: field names of each unique index, fewest
+            # fields first, compound keys are only usable as a whole
+            val._unique_keys = sorted(
+                [tuple(key for key, _ in idx.keys) for idx in val._indexes
+                 if idx.kwargs.get('unique')], key=len)
+            val._unique_fields = frozenset(
+                key for keys in val._unique_keys for key in keys)
+
+            # client side validation before writes: 'full', 'changed'
+            # (assigned fields only) or 'off', see Document.json_schema
+            # for the server side
+            val._client_validation = getattr(val, 'client_validation',
+                                             'full')
+            if val._client_validation not in CLIENT_VALIDATION:
+                raise ArgumentError(name, val._client_validation)
+            val._server_validation = getattr(
+                val, 'server_validation', val._client_validation != 'full')
+            val._validation_level = getattr(val, 'validation_level',
+                                            'strict')
+            val._validation_action = getattr(val, 'validation_action',
+                                             'error')
+            # upsert by inserting first, see MapperMixin.upsert
+            val._insert_first = getattr(val, 'insert_first', False)
 
             if not hasattr(val, '__collection__'):
                 setattr(val, '__collection__', name.lower())
@@ -109,10 +145,13 @@ class DocumentType(EmbeddedDocumentType):
 
         new_cls = super(DocumentType, cls).__new__(cls, name, bases, dct)
 
-        # setting up connection hook
-        for base in bases:
-            if base.__name__ == 'Document':
-                Connection.docdb[new_cls] = None
+        # setting up connection hook, abstract bases (e.g. BucketDocument)
+        # are not registered, but their subclasses are
+        if not dct.get('__abstract__'):
+            for base in bases:
+                if base.__name__ == 'Document' or \
+                        base.__dict__.get('__abstract__'):
+                    Connection.docdb[new_cls] = None
         return new_cls
 
 
@@ -205,14 +244,120 @@ class IDFormatter(object):
     ...         IDFormatter('{author}_{pid}')
 
     can also use a callable function
+
+    Templates are parsed once: `fields` are the field names they use,
+    and format_id() only formats when all of them are present.
     """
 
     def __init__(self, tmpl_or_cb):
+        # None when unknown, for callables
+        self.fields = None
         if callable(tmpl_or_cb):
             self._format = tmpl_or_cb
         elif isinstance(tmpl_or_cb, str):
-            def _format(**kwargs):
-                return tmpl_or_cb.format(**kwargs)
-            self._format = _format
+            fields = []
+            for _, name, _, _ in string.Formatter().parse(tmpl_or_cb):
+                if name is None:
+                    continue
+                # '{a.b}' and '{a[0]}' use field a
+                name = re.split(r'[.\[]', name, 1)[0]
+                if not name or name.isdigit():
+                    # positional fields can't be filled from _data
+                    raise ArgumentError(IDFormatter, tmpl_or_cb)
+                if name not in fields:
+                    fields.append(name)
+            self.fields = tuple(fields)
+            self._format = tmpl_or_cb.format
         else:
             raise ArgumentError(IDFormatter, tmpl_or_cb)
+
+    def format_id(self, data):
+        """ _id for data, None if a field it needs is missing """
+        if self.fields is None:
+            try:
+                return self._format(**data)
+            except KeyError:
+                return None
+        for name in self.fields:
+            if name not in data:
+                return None
+        return self._format(**data)
+
+
+class Bucket(object):
+
+    """ Bucket for BucketDocument
+
+    >>> class Reading(BucketDocument):
+    ...     class Meta:
+    ...         bucket = Bucket('sensor', 'ts', window=3600, size=200)
+    ...     sensor = StringField()
+    ...     ts = DateTimeField()
+    ...     value = FloatField()
+
+    Records sharing the `key` field value and falling in the same `window`
+    (in seconds) of the `time_field` are stored together, at most `size`
+    records per bucket document.
+    """
+
+    def __init__(self, key, time_field, window=3600, size=1000):
+        if not isinstance(key, str) or not isinstance(time_field, str) \
+                or window <= 0 or size <= 0:
+            raise ArgumentError(Bucket, (key, time_field, window, size))
+        self.key = key
+        self.time_field = time_field
+        self.window = window
+        self.size = size
+
+
+class View(object):
+
+    """ View for MaterializedView
+
+    >>> class DailySales(MaterializedView):
+    ...     class Meta:
+    ...         view = View(Order, [
+    ...             {'$group': {'_id': {'shop': '$shop', 'day': '$day'},
+    ...                         'total': {'$sum': '$amount'}}}],
+    ...             partition_key='shop')
+    ...     total = FloatField()
+
+    :param source: Document class the pipeline runs on
+    :param pipeline: aggregation stages producing the view documents
+    :param watermark: DateTimeField of source updated on every write,
+                      the first one declared with modified=True if None
+    :param partition_key: source field the output documents depend on,
+                          refreshes recompute every changed value of it
+                          over all source documents, instead of running
+                          the pipeline on changed documents only
+    :param on: $merge `on` fields of the view collection
+    :param when_matched: $merge `whenMatched`, e.g. 'merge' or a pipeline
+                         folding new values into existing ones
+    :param lag: seconds of source writes before the last watermark that
+                every refresh merges again, for writes committed after
+                the refresh that read their watermark value. Watermark
+                values come from the clocks of the writing clients, so
+                lag must also cover their skew. Use 0 with a when_matched
+                pipeline that can't fold the same documents twice.
+    """
+
+    def __init__(self, source, pipeline, watermark=None, partition_key=None,
+                 on='_id', when_matched='replace', lag=60):
+        if not isinstance(pipeline, list):
+            raise ArgumentError(View, pipeline)
+        self.source = source
+        self.pipeline = pipeline
+        self.watermark = watermark
+        self.partition_key = partition_key
+        self.on = on
+        self.when_matched = when_matched
+        self.lag = lag
+
+    def watermark_field(self):
+        if self.watermark is not None:
+            return self.watermark
+        for name, field in self.source._fields.items():
+            if getattr(field, 'modified', False):
+                return name
+        raise ConfigError('{} has no DateTimeField(modified=True) to '
+                          'refresh views from'.format(self.source.__name__))
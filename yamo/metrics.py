@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+
+# (event name, Document class name) -> count
+counters = Counter()
+
+# callables(name, cls, info), see add_hook
+hooks = []
+
+
+def add_hook(hook):
+    """ call hook(name, cls, info) on every event, e.g. to feed statsd
+
+    >>> def hook(name, cls, info):
+    ...     statsd.incr('yamo.{}.{}'.format(name, cls.__name__))
+    >>> yamo.metrics.add_hook(hook)
+    """
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+
+def incr(name, cls, **info):
+    """ count an event of a Document class, then call the hooks """
+    with _lock:
+        counters[(name, cls.__name__)] += 1
+    for hook in hooks:
+        hook(name, cls, info)
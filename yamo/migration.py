@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Data migrations
+
+A migration is a list of transforms of raw documents, one pass over a
+Document class each. Passes scan the collection with the partitioned scan
+of :mod:`yamo.parallel` and write the changes with unordered bulk writes
+of minimal $set/$unset updates. Progress is checkpointed, running a
+migration again resumes it, or does nothing once it is done.
+
+    >>> migration = Migration('2024-05-post-dates')
+    >>> @migration.transform(Post, {'created': {'$type': 'string'}})
+    ... def parse_created(data):
+    ...     data['created'] = Post._fields['created'].to_python(
+    ...         data['created'])
+    >>> @migration.transform(Post)
+    ... def rename_body(data):
+    ...     data['text'] = data.pop('body', '')
+    >>> migration.run(workers=4, max_rate=2000)
+"""
+import copy
+import time
+import logging
+from datetime import datetime
+
+from .errors import ArgumentError
+from .pagination import get_path
+from .parallel import Checkpoint, parallel_query
+from .unitofwork import diff
+from .lazy import lazy_import
+
+log = logging.getLogger('yamo')
+
+operations = lazy_import('pymongo.operations')
+
+
+class Transform(object):
+
+    """ Applies a transform to a batch of raw documents, in a worker
+
+    Sleeps after each batch to keep the pass under `max_rate` documents
+    per second, shared by all workers.
+    """
+
+    def __init__(self, cls, func, max_rate=None, workers=1):
+        self.cls = cls
+        self.func = func
+        self.max_rate = max_rate
+        self.workers = workers
+
+    def target(self, data):
+        """ _id and shard key filter of a raw document """
+        filter_ = {'_id': data['_id']}
+        shardkey = self.cls.Meta._shardkey
+        if shardkey is not None:
+            for key in shardkey.key:
+                value = get_path(data, key)
+                if value is not None:
+                    filter_[key] = value
+        return filter_
+
+    def __call__(self, datas):
+        start = time.time()
+        requests = []
+        for data in datas:
+            old = copy.deepcopy(data)
+            new = self.func(data)
+            if new is None:
+                # changed in place
+                new = data
+            update = diff(old, new)
+            if update:
+                requests.append(operations.UpdateOne(self.target(old),
+                                                     update))
+        if requests:
+            self.cls._coll.bulk_write(requests, ordered=False)
+        if self.max_rate:
+            delay = len(datas) * self.workers / self.max_rate
+            time.sleep(max(0, delay - (time.time() - start)))
+
+
+class Migration(object):
+
+    """ A named list of transforms, applied once
+
+    :param name: unique name, used for checkpoints and to record that
+                 the migration is done
+    :param collection: collection recording done migrations, in the
+                       database of the first migrated Document
+    """
+
+    def __init__(self, name, collection='yamo_migrations'):
+        self.name = name
+        self.collection = collection
+        # [(Document class, filter, function)]
+        self.transforms = []
+
+    def transform(self, cls, filter=None):
+        """ decorator declaring a transform of the documents of cls
+
+        The function takes the raw document, modifies it in place or
+        returns the new one. Transforms run in declaration order, each in
+        its own pass over the documents matching filter.
+        """
+        def deco(func):
+            self.transforms.append((cls, filter, func))
+            return func
+        return deco
+
+    def _coll(self):
+        if not self.transforms:
+            raise ArgumentError(Migration, self.name)
+        return self.transforms[0][0]._db[self.collection]
+
+    def is_done(self):
+        return self._coll().find_one({'_id': self.name}) is not None
+
+    def checkpoint(self, index):
+        cls, _, func = self.transforms[index]
+        return Checkpoint('{}:{}:{}.{}'.format(
+            self.name, index, cls.__name__, func.__name__))
+
+    def run(self, workers=4, executor='thread', batch_size=500,
+            max_rate=None):
+        """ run or resume the migration, return scanned documents per pass
+
+        :param workers: size of the pool of each pass
+        :param executor: 'thread' or 'process', transforms must be
+                         importable functions for the latter
+        :param batch_size: documents per find and bulk_write
+        :param max_rate: max documents per second, None for no limit
+
+        Documents of a batch may be transformed twice when resuming
+        after a crash, so transforms should be idempotent.
+        """
+        if self.is_done():
+            log.info('migration {} already done'.format(self.name))
+            return []
+        counts = []
+        for index, (cls, filter, func) in enumerate(self.transforms):
+            checkpoint = self.checkpoint(index).bind(cls)
+            count = parallel_query(
+                cls, filter, workers=workers, executor=executor,
+                batch_size=batch_size, checkpoint=checkpoint, raw=True,
+                callback=Transform(cls, func, max_rate, workers))
+            log.info('migration {}: {} documents scanned by {}'
+                     ''.format(self.name, count, func.__name__))
+            counts.append(count)
+        self._coll().replace_one(
+            {'_id': self.name},
+            {'_id': self.name, 'done': datetime.utcnow(), 'counts': counts},
+            upsert=True)
+        for index, (cls, _, _) in enumerate(self.transforms):
+            self.checkpoint(index).bind(cls).clear()
+        return counts
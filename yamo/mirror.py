@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import copy
+import time
+import logging
+import threading
+from datetime import datetime
+
+from .fields import DateTimeField
+from .lazy import lazy_import
+
+log = logging.getLogger('yamo')
+
+errors = lazy_import('pymongo.errors')
+
+MISS = object()
+
+
+class Mirror(object):
+
+    """ Used in Model.mirror
+
+    Keeps the whole collection in memory, indexed by `_id` and by the
+    single field unique indexes, so that query_one can be answered
+    without a round trip. Kept current by tailing a change stream, or by
+    polling a `DateTimeField(modified=True)` field where change streams
+    are not available (standalone servers). Without such a field, the
+    polling mirror only catches up on full reloads. Polls start from the
+    latest modified value seen, or the time of the last load.
+
+    :param poll_interval: seconds between two polls
+    :param reload_interval: seconds between two full reloads when
+                            polling, deletions are only seen then
+    """
+    # cls -> Mirror
+    mirrors = {}
+
+    def __init__(self, cls, poll_interval=1, reload_interval=300):
+        self.cls = cls
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        # _id -> raw data
+        self.docs = {}
+        # field name -> value -> _id
+        self.indexes = {}
+        for idx in cls.Meta._indexes or []:
+            if idx.kwargs.get('unique') and len(idx.keys) == 1:
+                self.indexes[idx.keys[0][0]] = {}
+        self.modified = None
+        for name, field in cls._fields.items():
+            if isinstance(field, DateTimeField) and field.modified:
+                self.modified = name
+                break
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        stream = self._watch()
+        self.load()
+        self.thread = threading.Thread(target=self._run, args=(stream,),
+                                       daemon=True)
+        self.thread.start()
+        self.mirrors[self.cls] = self
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.mirrors.get(self.cls) is self:
+            del self.mirrors[self.cls]
+
+    def load(self):
+        started = time.time()
+        docs = {}
+        indexes = {name: {} for name in self.indexes}
+        for data in self.cls._coll.find():
+            docs[data['_id']] = data
+            for name, index in indexes.items():
+                if data.get(name) is not None:
+                    index[data[name]] = data['_id']
+        with self.lock:
+            self.docs = docs
+            self.indexes = indexes
+        self.loaded_at = started
+
+    def put(self, data):
+        _id = data['_id']
+        with self.lock:
+            old = self.docs.get(_id)
+            self.docs[_id] = data
+            for name, index in self.indexes.items():
+                if old and old.get(name) != data.get(name) \
+                        and index.get(old.get(name)) == _id:
+                    del index[old[name]]
+                if data.get(name) is not None:
+                    index[data[name]] = _id
+
+    def remove(self, _id):
+        with self.lock:
+            old = self.docs.pop(_id, None)
+            if old:
+                for name, index in self.indexes.items():
+                    if index.get(old.get(name)) == _id:
+                        del index[old[name]]
+
+    def lookup(self, filter=None, *args, **kwargs):
+        """ find one raw document locally
+
+        return MISS if the query can't be answered locally, in which
+        case it should be sent to the server
+        """
+        if args or kwargs or not filter or not isinstance(filter, dict):
+            return MISS
+        for key, value in filter.items():
+            if key.startswith('$') or '.' in key or \
+                    isinstance(value, (dict, list)):
+                return MISS
+
+        if '_id' in filter:
+            data = self.docs.get(filter['_id'])
+        else:
+            data = None
+            for name, index in self.indexes.items():
+                if name in filter:
+                    data = self.docs.get(index.get(filter[name]))
+                    break
+            else:
+                for candidate in list(self.docs.values()):
+                    if self._match(candidate, filter):
+                        data = candidate
+                        break
+        if data is not None and not self._match(data, filter):
+            data = None
+        if data is not None:
+            data = copy.deepcopy(data)
+        return data
+
+    @staticmethod
+    def _equal(stored, value):
+        """ == of the server, where booleans are not numbers """
+        if isinstance(stored, bool) != isinstance(value, bool):
+            return False
+        return stored == value
+
+    @classmethod
+    def _match(cls, data, filter):
+        for key, value in filter.items():
+            stored = data.get(key)
+            if not cls._equal(stored, value) and not (
+                    isinstance(stored, list)
+                    and any(cls._equal(v, value) for v in stored)):
+                return False
+        return True
+
+    def _watch(self):
+        try:
+            return self.cls._coll.watch(full_document='updateLookup',
+                                        max_await_time_ms=1000)
+        except errors.OperationFailure as e:
+            log.info('change stream unavailable for {}, polling: {}'
+                     ''.format(self.cls.__name__, e))
+
+    def _run(self, stream):
+        polling = stream is None
+        while not self.stopped.is_set():
+            try:
+                if not polling and stream is None:
+                    stream = self._watch()
+                    polling = stream is None
+                    self.load()
+                if polling:
+                    self._poll()
+                else:
+                    self._tail(stream)
+                    stream = None
+            except errors.PyMongoError as e:
+                log.warning('mirror of {} failed: {}'
+                            ''.format(self.cls.__name__, e))
+                stream = None
+                self.stopped.wait(self.poll_interval)
+
+    def _tail(self, stream):
+        with stream:
+            while not self.stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                op = change['operationType']
+                if op in ('insert', 'update', 'replace'):
+                    if change.get('fullDocument'):
+                        self.put(change['fullDocument'])
+                    else:
+                        self.remove(change['documentKey']['_id'])
+                elif op == 'delete':
+                    self.remove(change['documentKey']['_id'])
+                else:
+                    # drop, rename, invalidate
+                    return
+
+    def _poll(self):
+        since = None
+        while not self.stopped.wait(self.poll_interval):
+            if time.time() - self.loaded_at > self.reload_interval:
+                self.load()
+                since = None
+            elif self.modified:
+                if since is None:
+                    since = max([d.get(self.modified) for d in
+                                 list(self.docs.values()) if isinstance(
+                                     d.get(self.modified), datetime)]
+                                or [None])
+                if since is None:
+                    # no document has been modified yet
+                    since = datetime.utcfromtimestamp(self.loaded_at)
+                filter_ = {self.modified: {'$gte': since}}
+                for data in self.cls._coll.find(filter_):
+                    self.put(data)
+                    value = data.get(self.modified)
+                    if isinstance(value, datetime) and value > since:
+                        since = value
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pickle
+
+from .lazy import lazy_import
+
+bson = lazy_import('bson')
+
+
+def build(cls, data, changed=()):
+    """ Document or EmbeddedDocument of class cls holding data
+
+    Documents are built outside of the session, see Document._from_data
+    """
+    if hasattr(cls, '_from_data'):
+        return cls._from_data(data, changed)
+    instance = cls()
+    instance._data = data
+    return instance
+
+
+def rebuild(cls, raw, defaults=None, changed=()):
+    """ unpickle a document reduced by reduce_document() """
+    instance = build(cls, bson.BSON(raw).decode(), changed)
+    if defaults:
+        instance._defaults = defaults
+    return instance
+
+
+def rebuild_data(cls, data, defaults=None, changed=()):
+    """ unpickle a document whose _data is not BSON encodable """
+    instance = build(cls, data, changed)
+    if defaults:
+        instance._defaults = defaults
+    return instance
+
+
+def state(doc):
+    """ (_defaults, changed fields) of doc, None for a document just
+    loaded, whose _defaults are empty and fields unchanged
+    """
+    # EmbeddedDocuments don't track changes
+    changed = doc._changed if hasattr(doc, '_from_data') else ()
+    if changed is not None:
+        changed = tuple(sorted(changed))
+    if changed == () and not doc._defaults:
+        return None
+    return doc._defaults or None, changed
+
+
+def restore(instance, state_):
+    """ set the _defaults of state() on a built instance """
+    if state_ is not None and state_[0]:
+        instance._defaults = state_[0]
+    return instance
+
+
+def reduce_document(doc):
+    """ __reduce__ of Documents: the class and the BSON encoded _data
+
+    _refs are rebuilt from _data. _defaults and the fields changed since
+    loaded (None for a new Document) are only kept when they differ from
+    a document just loaded. Like when saved, BSON keeps datetimes to the
+    millisecond, and aware ones come back as naive UTC.
+    """
+    args = (type(doc),)
+    try:
+        args += (bson.BSON.encode(doc._data),)
+        func = rebuild
+    except (bson.errors.InvalidDocument, TypeError, OverflowError):
+        # e.g. a DictField with non string keys, or ints over 8 bytes
+        args += (doc._data,)
+        func = rebuild_data
+    state_ = state(doc)
+    if state_ is not None:
+        defaults, changed = state_
+        if changed != ():
+            args += (defaults, changed)
+        else:
+            args += (defaults,)
+    return func, args
+
+
+def pack(docs):
+    """ encode Documents into one buffer, to hand them to another process
+
+    >>> payload = pack(Post.query({...}))
+    >>> docs = unpack(payload)  # in a worker process
+
+    All _data are BSON encoded back to back, so unpack decodes them with
+    a single decode_all call. _defaults and changed fields are kept as
+    by pickle. Like when saved, BSON keeps datetimes to the millisecond,
+    and aware ones come back as naive UTC.
+    """
+    classes = []
+    indexes = []
+    states = []
+    buf = bytearray()
+    for doc in docs:
+        cls = type(doc)
+        if cls not in classes:
+            classes.append(cls)
+        indexes.append(classes.index(cls))
+        states.append(state(doc))
+        buf += bson.BSON.encode(doc._data)
+    if len(classes) <= 1:
+        indexes = None
+    if not any(s is not None for s in states):
+        states = None
+    return pickle.dumps((classes, indexes, states, bytes(buf)),
+                        pickle.HIGHEST_PROTOCOL)
+
+
+def unpack(payload):
+    """ Documents encoded by pack() """
+    classes, indexes, states, buf = pickle.loads(payload)
+    datas = bson.decode_all(buf)
+    if indexes is None:
+        indexes = [0] * len(datas)
+    if states is None:
+        states = [None] * len(datas)
+    docs = []
+    for i, data, state_ in zip(indexes, datas, states):
+        changed = () if state_ is None else state_[1]
+        docs.append(restore(build(classes[i], data, changed), state_))
+    return docs
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import base64
+from datetime import datetime
+
+from .errors import ArgumentError, ConfigError
+from .lazy import lazy_import
+
+bson = lazy_import('bson')
+
+# $type aliases in BSON comparison order, the types of a group compare
+# with each other
+TYPE_ORDER = [['minKey'], ['null'], ['int', 'long', 'double', 'decimal'],
+              ['symbol', 'string'], ['object'], ['array'], ['binData'],
+              ['objectId'], ['bool'], ['date'], ['timestamp'], ['regex'],
+              ['maxKey']]
+
+
+class Page(list):
+
+    """ A page of Documents returned by Model.paginate
+
+    `token` is an opaque string continuing after this page, None on the
+    last page
+    """
+
+    def __init__(self, docs, token=None):
+        super(Page, self).__init__(docs)
+        self.token = token
+
+
+def sort_keys(order_by):
+    """ normalize order_by like Index keys, ending with an _id tiebreaker """
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    keys = []
+    for key in order_by or []:
+        if isinstance(key, str):
+            key = (key, 1)
+        elif not (isinstance(key, tuple) and len(key) == 2
+                  and key[1] in (1, -1)):
+            raise ArgumentError(sort_keys, order_by)
+        keys.append(key)
+    if '_id' not in [k for k, _ in keys]:
+        keys.append(('_id', 1))
+    return keys
+
+
+def check_index(cls, keys):
+    """ make sure a declared Index can serve the sort keys, returns the
+    keys to sort by
+
+    The index must end with the _id tiebreaker, in the sort directions
+    or all inverted, unless a unique index already orders documents by
+    the other keys, then the tiebreaker is left out.
+    """
+    keys = [tuple(k) for k in keys]
+    if [k for k, _ in keys] == ['_id']:
+        return keys
+    fields = [k for k in keys if k[0] != '_id']
+    inverted = [(k, -d) for k, d in keys]
+    inverted_fields = [(k, -d) for k, d in fields]
+    for idx in cls.Meta._indexes or []:
+        idx_keys = [tuple(k) for k in idx.keys]
+        prefix = idx_keys[:len(keys)]
+        if prefix == keys or prefix == inverted:
+            return keys
+        if idx.kwargs.get('unique') and \
+                idx_keys in (fields, inverted_fields):
+            return fields
+    raise ConfigError('No Index on {} supports paginating by {}, '
+                      'declare one in Meta'.format(cls.__name__, keys))
+
+
+def get_path(data, key):
+    for part in key.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def encode_token(keys, values):
+    raw = bson.BSON.encode({'k': [k for k, _ in keys], 'v': values})
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_token(keys, token):
+    try:
+        d = bson.BSON(base64.urlsafe_b64decode(token.encode('ascii')))
+        d = d.decode()
+    except Exception:
+        raise ArgumentError(decode_token, token)
+    if d['k'] != [k for k, _ in keys]:
+        raise ArgumentError(decode_token, token)
+    return d['v']
+
+
+def type_group(value):
+    """ index in TYPE_ORDER of the BSON type of a python value, None for
+    the types not listed there, e.g. Code or DBRef
+    """
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (bson.Code, bson.DBRef)):
+        # Code is a str
+        return None
+    kinds = [(bson.MinKey,), (), (int, float, bson.Decimal128), (str,),
+             (dict,), (list, tuple), (bytes,), (bson.ObjectId,), (),
+             (datetime,), (bson.Timestamp,),
+             (bson.Regex, type(re.compile(''))), (bson.MaxKey,)]
+    for group, types in enumerate(kinds):
+        if types and isinstance(value, types):
+            return group
+    return None
+
+
+def after(key, direction, value):
+    """ match values of key strictly after value in the sort order
+
+    $gt and $lt only compare values of the same BSON type, values of the
+    types sorted after the type of value are matched by $type, and a
+    null or missing key by equality to None when it sorts after value.
+    Values of a type missing from TYPE_ORDER are only compared with $gt
+    or $lt.
+    """
+    group = type_group(value)
+    if group is None:
+        return {key: {'$gt' if direction == 1 else '$lt': value}}
+    later = TYPE_ORDER[group + 1:] if direction == 1 else TYPE_ORDER[:group]
+    aliases = [alias for types in later for alias in types
+               if alias != 'null']
+    conds = []
+    if value is not None:
+        conds.append({key: {'$gt' if direction == 1 else '$lt': value}})
+    if ['null'] in later:
+        conds.append({key: None})
+    if aliases:
+        conds.append({key: {'$type': aliases}})
+    return conds[0] if len(conds) == 1 else {'$or': conds}
+
+
+def seek_filter(keys, values):
+    """ match documents strictly after `values` in the sort order
+
+    (a, b, _id) > (x, y, z) is expanded to
+    a > x or (a == x and b > y) or (a == x and b == y and _id > z)
+
+    Equality on a null value also matches a missing key, as in the sort.
+    """
+    clauses = []
+    for i, (key, direction) in enumerate(keys):
+        clause = {k: v for (k, _), v in zip(keys[:i], values[:i])}
+        clause.update(after(key, direction, values[i]))
+        clauses.append(clause)
+    if len(clauses) == 1:
+        return clauses[0]
+    return {'$or': clauses}
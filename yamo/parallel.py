@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Partitioned collection scans
+
+The key space is split at sampled key values into ranges, and each range
+is scanned in batches sorted by key, every batch starting after the last
+key of the previous one. Batches run in a thread or process pool, at most
+one per partition at a time, so a scan can stop and resume anywhere.
+
+MongoDB only compares values of the same BSON type, so split points all
+have the most sampled type, and one more partition holds the documents
+whose key has another type or is null or missing.
+
+    >>> for post in Post.parallel_query({'lang': 'en'}, workers=8):
+    ...     handle(post)
+"""
+import logging
+from collections import deque
+
+from .errors import ArgumentError
+from .pagination import (sort_keys, seek_filter, get_path, type_group,
+                         TYPE_ORDER)
+from .packing import pack, unpack
+from .lazy import lazy_import
+
+log = logging.getLogger('yamo')
+
+bson = lazy_import('bson')
+
+EXECUTORS = ('thread', 'process')
+
+class Checkpoint(object):
+
+    """ Progress of a partitioned job, one document per partition
+
+    :param name: job name, run the job again with the same name to resume
+    :param collection: collection keeping the checkpoints, in the database
+                       of the scanned Document
+
+    A partition is a dict with `index`, `lo` and `hi` (key range, None
+    when open), `types` ($type aliases of the range, None for a
+    partition of any type), `exclude` ($type aliases left out of that
+    partition), `last` (sort values of the last document done, None
+    before the first batch), `count` and `done`.
+    """
+
+    def __init__(self, name, collection='yamo_checkpoints'):
+        self.name = name
+        self.collection = collection
+        self.coll = None
+
+    def bind(self, cls):
+        """ keep checkpoints in the database of Document class cls """
+        if self.coll is None:
+            self.coll = cls._db[self.collection]
+        return self
+
+    def load(self):
+        """ saved partitions, in index order, empty if none """
+        docs = self.coll.find({'job': self.name}, sort=[('index', 1)])
+        return [{k: v for k, v in doc.items() if k not in ('_id', 'job')}
+                for doc in docs]
+
+    def save(self, partition):
+        self.coll.replace_one(
+            {'_id': '{}:{}'.format(self.name, partition['index'])},
+            dict(partition, job=self.name), upsert=True)
+
+    def clear(self):
+        """ forget the progress, the next run starts over """
+        self.coll.delete_many({'job': self.name})
+
+
+def partition_key(cls):
+    """ first field of a ranged ShardKey, `_id` otherwise """
+    shardkey = cls.Meta._shardkey
+    if shardkey is not None:
+        key, kind = next(iter(shardkey.key.items()))
+        if kind in (1, -1):
+            return key
+    return '_id'
+
+
+def split_points(cls, filter, key, partitions, sample_size=None):
+    """ sorted, distinct values of key splitting the matching documents
+    into about `partitions` ranges of the same size
+
+    Returns the points and their $type aliases, points all have the
+    most sampled type.
+    """
+    if partitions < 2:
+        return [], None
+    if sample_size is None:
+        sample_size = min(partitions * 32, 10000)
+    pipeline = [{'$sample': {'size': sample_size}},
+                {'$project': {'_id': 0, 'k': '$' + key}},
+                {'$sort': {'k': 1}}]
+    if filter:
+        pipeline.insert(0, {'$match': filter})
+    values = [doc['k'] for doc in cls._coll.aggregate(pipeline)
+              if doc.get('k') is not None]
+    groups = [type_group(value) for value in values]
+    # values of unlisted types are left to the untyped partition
+    known = [g for g in groups if g is not None]
+    if not known:
+        return [], None
+    group = max(set(known), key=known.count)
+    values = [v for v, g in zip(values, groups) if g == group]
+    points = []
+    for i in range(1, partitions):
+        value = values[i * len(values) // partitions] if values else None
+        if value is not None and (not points or points[-1] != value):
+            points.append(value)
+    return points, TYPE_ORDER[group]
+
+
+def scan_batch(cls, filter, keys, lo, hi, last, batch_size, callback=None,
+               packed=False, raw=False, types=None, exclude=None):
+    """ Scan the next batch of a partition, runs in a worker
+
+    :param types: $type aliases of lo and hi, None if the partition holds
+                  keys of any type
+    :param exclude: $type aliases to leave out of an untyped partition
+
+    Returns (last, count, done, documents), documents are None when
+    given to callback, packed when sent back from another process, and
+    raw dicts instead of Documents if raw.
+    """
+    key = keys[0][0]
+    conds = [filter] if filter else []
+    if lo is not None:
+        conds.append({key: {'$gte': lo}})
+    if hi is not None:
+        conds.append({key: {'$lt': hi}})
+    if exclude:
+        conds.append({key: {'$not': {'$type': exclude}}})
+    if last is not None:
+        conds.append(seek_filter(keys, last))
+    filter_ = {'$and': conds} if len(conds) > 1 else \
+        (conds[0] if conds else {})
+
+    docs = list(cls._coll.find(filter_, sort=keys, limit=batch_size))
+    if docs:
+        last = [get_path(docs[-1], k) for k, _ in keys]
+    if not raw:
+        docs = [cls.from_storage(doc) for doc in docs]
+    done = len(docs) < batch_size
+    if callback is not None:
+        callback(docs)
+        return last, len(docs), done, None
+    return last, len(docs), done, pack(docs) if packed else docs
+
+
+def parallel_query(cls, filter=None, workers=4, partitions=None,
+                   executor='thread', batch_size=1000, callback=None,
+                   checkpoint=None, raw=False):
+    """ see Model.parallel_query, with raw dicts instead of Documents if
+    raw
+    """
+    if executor not in EXECUTORS:
+        raise ArgumentError(parallel_query, executor)
+    keys = sort_keys([partition_key(cls)])
+
+    parts = None
+    if checkpoint is not None:
+        parts = checkpoint.bind(cls).load()
+    if not parts:
+        points, types = split_points(cls, filter, keys[0][0],
+                                     partitions or workers * 4)
+        if points:
+            bounds = [None] + points + [None]
+            ranges = [(lo, hi, types) for lo, hi in zip(bounds, bounds[1:])]
+            # keys of other types, null or missing
+            ranges.append((None, None, None))
+        else:
+            ranges = [(None, None, None)]
+        parts = [{'index': i, 'lo': lo, 'hi': hi, 'types': part_types,
+                  'exclude': types if points and not part_types else None,
+                  'last': None, 'count': 0, 'done': False}
+                 for i, (lo, hi, part_types) in enumerate(ranges)]
+        if checkpoint is not None:
+            for part in parts:
+                checkpoint.save(part)
+
+    scan = _scan(cls, filter, keys, parts, workers, executor, batch_size,
+                 callback, checkpoint, raw)
+    if callback is None:
+        return scan
+    for _ in scan:
+        pass
+    return sum(part['count'] for part in parts)
+
+
+def _scan(cls, filter, keys, parts, workers, executor, batch_size,
+          callback, checkpoint, raw=False):
+    from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                    FIRST_COMPLETED, wait)
+    # raw dicts pickle well enough as they are
+    packed = executor == 'process' and not raw
+    pool_cls = ProcessPoolExecutor if executor == 'process' \
+        else ThreadPoolExecutor
+    todo = deque(part for part in parts if not part['done'])
+    # future -> partition, a partition has one batch in flight at most
+    futures = {}
+
+    with pool_cls(workers) as pool:
+        def submit():
+            part = todo.popleft()
+            future = pool.submit(scan_batch, cls, filter, keys, part['lo'],
+                                 part['hi'], part['last'], batch_size,
+                                 callback, packed, raw, part.get('types'),
+                                 part.get('exclude'))
+            futures[future] = part
+
+        while todo and len(futures) < workers:
+            submit()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                part = futures.pop(future)
+                last, count, finished, docs = future.result()
+                part['last'] = last
+                part['count'] += count
+                part['done'] = finished
+                if not finished:
+                    # round robin over the partitions
+                    todo.append(part)
+                if todo:
+                    submit()
+                if docs is not None:
+                    for doc in unpack(docs) if packed else docs:
+                        yield doc
+                # only once handled, a batch may be seen twice on resume
+                # but never skipped
+                if checkpoint is not None:
+                    checkpoint.save(part)
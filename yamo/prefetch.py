@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Read-ahead of query results
+
+A thread fetches the raw batches of a cursor and decodes them while the
+caller handles the previous ones, so network round trips and BSON
+decoding overlap with the work done per document. Documents are built
+in the thread of the caller, in its session if any.
+
+    >>> for post in Post.query({'lang': 'en'}, prefetch=4):
+    ...     handle(post)
+"""
+import threading
+from collections import deque
+
+from . import deadlines
+from .lazy import lazy_import
+
+bson = lazy_import('bson')
+
+# default max raw bytes of the batches fetched ahead
+MAX_BYTES = 16 * 1024 * 1024
+
+_END = object()
+
+
+class Prefetcher(object):
+
+    """ Keeps up to `depth` batches of cursor decoded ahead of the consumer
+
+    Batches are decoded to raw dicts in the fetching thread, and turned
+    into Documents by the consumer, as the session is per thread.
+
+    :param cls: Document class of the results
+    :param cursor: a find_raw_batches cursor
+    :param depth: max batches waiting for the consumer
+    :param max_bytes: max raw bytes of the waiting batches, one batch is
+                      always let through however large it is
+
+    Errors of the fetching thread are raised by the consumer. Leaving the
+    loop early, or dropping the iterator, stops the thread and closes the
+    cursor.
+    """
+
+    def __init__(self, cls, cursor, depth, max_bytes=MAX_BYTES):
+        self.cls = cls
+        self.cursor = cursor
+        self.codec_options = cls._coll.codec_options
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        # (raw documents or _END or exception, raw size)
+        self.items = deque()
+        self.size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def _full(self, size):
+        if not self.items:
+            return False
+        return len(self.items) >= self.depth or \
+            self.size + size > self.max_bytes
+
+    def _put(self, item, size=0):
+        with self.cond:
+            self.items.append((item, size))
+            self.size += size
+            self.cond.notify_all()
+
+    def run(self):
+        try:
+            for batch in deadlines.translate(self.cls, self.cursor):
+                with self.cond:
+                    while not self.closed and self._full(len(batch)):
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                self._put(bson.decode_all(batch, self.codec_options),
+                          len(batch))
+            self._put(_END)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self.cursor.close()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __iter__(self):
+        thread = threading.Thread(target=self.run, daemon=True,
+                                  name='yamo-prefetch')
+        thread.start()
+        try:
+            while True:
+                with self.cond:
+                    while not self.items:
+                        self.cond.wait()
+                    item, size = self.items.popleft()
+                    self.size -= size
+                    self.cond.notify_all()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                from_storage = self.cls.from_storage
+                for data in item:
+                    yield from_storage(data)
+        finally:
+            self.close()
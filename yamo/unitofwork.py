@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import copy
+import logging
+import threading
+from collections import OrderedDict
+
+from . import deadlines
+from .lazy import lazy_import
+
+log = logging.getLogger('yamo')
+
+operations = lazy_import('pymongo.operations')
+
+_local = threading.local()
+
+
+def current_session():
+    """ return the innermost active session of this thread, or None """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+
+
+def same(a, b):
+    """ a == b, also comparing types: 1, 1.0 and True are stored as
+    different BSON values
+    """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and \
+            all(same(v, b[k]) for k, v in a.items())
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def diff(old, new):
+    """ build a minimal update document turning `old` into `new` """
+    to_set = {}
+    for key, value in new.items():
+        if key != '_id' and (key not in old or not same(old[key], value)):
+            to_set[key] = value
+    to_unset = {key: '' for key in old if key not in new}
+    update = {}
+    if to_set:
+        update['$set'] = to_set
+    if to_unset:
+        update['$unset'] = to_unset
+    return update
+
+
+class Session(object):
+
+    """ Identity map and unit of work
+
+    Documents loaded inside a session are unique per (class, _id), and
+    save/upsert/update/remove calls are recorded instead of being sent.
+    Recorded writes and modified documents are flushed on exit, as ordered
+    bulk_write calls per collection.
+
+    >>> with yamo.session() as s:
+    ...     p = Post.query_one({'_id': 1})
+    ...     p.title = 'new title'
+    ...     Post({'_id': 2}).save()
+
+    :param transaction: flush inside a MongoDB transaction
+    :param chunk_size: max number of operations per bulk_write call
+    """
+
+    def __init__(self, transaction=False, chunk_size=1000):
+        self.transaction = transaction
+        self.chunk_size = chunk_size
+        # (cls, _id) -> document
+        self.identity = {}
+        # id(document) -> (document, snapshot of _data)
+        self.tracked = OrderedDict()
+        # [(document, action, arg)]
+        self.pending = []
+
+    def __enter__(self):
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.stack.remove(self)
+        if exc_type is None:
+            self.flush()
+        else:
+            self.clear()
+
+    def get(self, cls, _id):
+        return self.identity.get((cls, _id))
+
+    def track(self, doc):
+        """ put a persisted document into the identity map """
+        _id = doc._data.get('_id')
+        if _id is not None:
+            self.identity[(doc.__class__, _id)] = doc
+        self.tracked[id(doc)] = (doc, copy.deepcopy(doc._data))
+
+    def save(self, doc):
+        self._record(doc, 'save')
+
+    def upsert(self, doc, null=False):
+        self._record(doc, 'upsert', null)
+
+    def update(self, doc, update):
+        self.pending.append((doc, 'update', update))
+
+    def remove(self, doc):
+        self._record(doc, 'remove')
+        self.identity.pop((doc.__class__, doc._data.get('_id')), None)
+
+    def _record(self, doc, action, arg=None):
+        # only the last save/upsert/remove of a document matters
+        self.pending = [p for p in self.pending
+                        if p[0] is not doc or p[1] == 'update']
+        self.pending.append((doc, action, arg))
+        if action != 'remove' and doc._data.get('_id') is not None:
+            self.identity[(doc.__class__, doc._data['_id'])] = doc
+
+    def clear(self):
+        self.identity.clear()
+        self.tracked.clear()
+        self.pending = []
+
+    def _operations(self):
+        """ yield (document, operation) in flush order """
+        # documents written whole, their attribute changes are included
+        recorded = set(id(p[0]) for p in self.pending if p[1] != 'update')
+        for doc, action, arg in self.pending:
+            if action == 'save':
+                yield doc, doc._save_op()
+            elif action == 'upsert':
+                yield doc, doc._upsert_op(arg)
+            elif action == 'update':
+                yield doc, operations.UpdateOne(doc._target_filter(), arg)
+            elif action == 'remove':
+                yield doc, operations.DeleteOne(doc._target_filter())
+
+        for key, (doc, snapshot) in self.tracked.items():
+            if key in recorded or '_id' not in snapshot:
+                continue
+            update = diff(snapshot, doc._data)
+            if update:
+                yield doc, operations.UpdateOne(
+                    doc._target_filter(snapshot), update)
+
+    def flush(self):
+        """ send all recorded writes, return number of bulk_write calls """
+        # collection name -> (collection, [(document, operation)])
+        groups = OrderedDict()
+        for doc, op in self._operations():
+            if op is None:
+                continue
+            coll = doc._coll
+            key = coll.full_name
+            if key not in groups:
+                groups[key] = (coll, [])
+            groups[key][1].append((doc, op))
+
+        calls = 0
+        if groups:
+            if self.transaction:
+                client = next(iter(groups.values()))[0].database.client
+                with client.start_session() as s:
+                    with s.start_transaction():
+                        calls = self._write(groups, s)
+            else:
+                calls = self._write(groups)
+            self._fetch_upserted_ids()
+
+        for doc, action, _ in self.pending:
+            if action == 'remove':
+                self.tracked.pop(id(doc), None)
+            elif action != 'update':
+                self.tracked[id(doc)] = (doc, None)
+        self.pending = []
+        for key, (doc, _) in list(self.tracked.items()):
+            self.tracked[key] = (doc, copy.deepcopy(doc._data))
+        return calls
+
+    def _fetch_upserted_ids(self):
+        """ _id of upserted documents that matched an existing one,
+        bulk_write only returns the _id of inserted ones
+        """
+        for doc, action, _ in self.pending:
+            if action != 'upsert' or doc._data.get('_id') is not None:
+                continue
+            filter_ = doc._upsert_filter()
+            if not filter_:
+                continue
+            found = doc._coll.find_one(filter_, {'_id': True})
+            if found is not None:
+                doc._data['_id'] = found['_id']
+                self.identity[(doc.__class__, found['_id'])] = doc
+
+    def _write(self, groups, mongo_session=None):
+        calls = 0
+        for coll, entries in groups.values():
+            for i in range(0, len(entries), self.chunk_size):
+                chunk = entries[i:i + self.chunk_size]
+                cls = type(chunk[0][0])
+                deadlines.check(cls)
+                with deadlines.bounded(cls):
+                    r = coll.bulk_write([op for _, op in chunk],
+                                        ordered=True, session=mongo_session)
+                calls += 1
+                for index, _id in r.upserted_ids.items():
+                    doc = chunk[index][0]
+                    doc._data['_id'] = _id
+                    self.identity[(doc.__class__, _id)] = doc
+        return calls
+
+
+def session(**kwargs):
+    """ start a new :class:`Session`, use as a context manager """
+    return Session(**kwargs)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from .document import Document
+from .errors import ConfigError
+
+# collection keeping the watermark of each view
+STATE_COLLECTION = 'yamo_views'
+
+
+class MaterializedView(Document):
+
+    """ Document stored as the result of an aggregation, see :class:`View`
+
+    The pipeline writes into the collection of the view with $merge.
+    Refreshes only look at source documents whose watermark field is
+    newer than the last refresh, and the view is queried like any other
+    Document, with its own indexes.
+
+    >>> DailySales.refresh_view()  # e.g. every minute
+    >>> DailySales.query({'_id.shop': 's1'})
+
+    Each refresh merges again the source writes of the last `lag`
+    seconds before the previous watermark, see :class:`View`. Deleted
+    source documents are only taken into account by rebuild().
+    """
+    __abstract__ = True
+
+    # max partition key values per refresh aggregation
+    partition_chunk = 1000
+
+    @classmethod
+    def _get_view(cls):
+        view = cls.Meta._view
+        if view is None:
+            raise ConfigError('{} declares no View in Meta'
+                              ''.format(cls.__name__))
+        return view
+
+    @classmethod
+    def _state(cls):
+        return cls._db[STATE_COLLECTION]
+
+    @classmethod
+    def watermark(cls):
+        """ watermark of the last refresh, None before the first one """
+        state = cls._state().find_one({'_id': cls.Meta.__collection__})
+        return state['watermark'] if state else None
+
+    @classmethod
+    def _set_watermark(cls, watermark):
+        cls._state().update_one(
+            {'_id': cls.Meta.__collection__},
+            {'$set': {'watermark': watermark,
+                      'refreshed': datetime.utcnow()}},
+            upsert=True)
+
+    @classmethod
+    def _high(cls, match):
+        """ newest watermark value of source documents matching match """
+        view = cls._get_view()
+        field = view.watermark_field()
+        newest = view.source._coll.find_one(
+            match, sort=[(field, -1)], projection={field: True})
+        return newest.get(field) if newest else None
+
+    @classmethod
+    def _aggregate(cls, match, out=False):
+        """ run the pipeline on the source documents matching match, and
+        merge the results into the view, or replace it with them if out
+        """
+        view = cls._get_view()
+        if out:
+            stage = {'$out': cls.Meta.__collection__}
+        else:
+            stage = {'$merge': {'into': cls.Meta.__collection__,
+                                'on': view.on,
+                                'whenMatched': view.when_matched,
+                                'whenNotMatched': 'insert'}}
+        pipeline = list(view.pipeline) + [stage]
+        if match:
+            pipeline.insert(0, {'$match': match})
+        # the stage runs when the aggregate command does, nothing is
+        # returned
+        list(view.source._coll.aggregate(pipeline))
+
+    @classmethod
+    def refresh_view(cls):
+        """ merge source changes since the last refresh into the view
+
+        Returns False if no source document was written since then, or
+        in the `lag` before.
+        """
+        view = cls._get_view()
+        field = view.watermark_field()
+        last = cls.watermark()
+        window = {}
+        if last is not None:
+            since = last - timedelta(seconds=view.lag) if view.lag else last
+            window = {field: {'$gt': since}}
+        high = cls._high(window)
+        if high is None:
+            return False
+        # later values wait for the next refresh, earlier ones committed
+        # after this read are merged again by the next refreshes, in lag
+        window = {field: dict(window.get(field, {}), **{'$lte': high})}
+
+        if view.partition_key is None:
+            cls._aggregate(window)
+        elif last is None:
+            cls._aggregate({})
+        else:
+            key = view.partition_key
+            values = view.source._coll.distinct(key, window)
+            for i in range(0, len(values), cls.partition_chunk):
+                chunk = values[i:i + cls.partition_chunk]
+                cls._aggregate({key: {'$in': chunk}})
+        # a source document deleted since may leave high below last
+        cls._set_watermark(high if last is None else max(high, last))
+        return True
+
+    @classmethod
+    def rebuild(cls):
+        """ recompute the whole view from the source documents
+
+        The results are written with $out, into a temporary collection
+        renamed over the view once complete, so readers never see a
+        partial view. The indexes of the view are kept.
+        """
+        high = cls._high({})
+        cls._aggregate({}, out=True)
+        cls._set_watermark(high)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from .errors import YamoException
+from .lazy import lazy_import
+
+log = logging.getLogger('yamo')
+
+operations = lazy_import('pymongo.operations')
+
+# update operators that can be folded into one
+MERGEABLE = {
+    '$set': lambda old, new: new,
+    '$setOnInsert': lambda old, new: old,
+    '$inc': lambda old, new: old + new,
+    '$max': max,
+    '$min': min,
+    '$unset': lambda old, new: new,
+}
+
+
+def merge_updates(old, new):
+    """ fold two update documents into one, None if they can't be """
+    if set(old) - set(MERGEABLE) or set(new) - set(MERGEABLE):
+        return None
+    fields = {}
+    for op, values in list(old.items()) + list(new.items()):
+        for key in values:
+            if fields.setdefault(key, op) != op:
+                # same field touched by two different operators
+                return None
+    merged = {op: dict(values) for op, values in old.items()}
+    for op, values in new.items():
+        target = merged.setdefault(op, {})
+        for key, value in values.items():
+            if key in target:
+                target[key] = MERGEABLE[op](target[key], value)
+            else:
+                target[key] = value
+    return merged
+
+
+class WriteBehind(object):
+
+    """ Used in Model.writer
+
+    Buffers writes and sends them with bulk_write from a background
+    thread, when `max_batch` writes are pending or `max_delay` seconds
+    after the first one. Repeated writes to the same document are
+    coalesced: a save, which sets every field, replaces a previous save
+    or upsert, and upserts or updates using $set/$setOnInsert/$inc/$max/
+    $min/$unset are folded into the previous one of the same kind.
+
+    :param max_batch: max writes per bulk_write call
+    :param max_delay: max seconds a write is buffered
+    :param max_queue: callers block while this many writes are pending
+    :param on_error: callback(exception, operations) for failed writes,
+                     failures are logged if not given, and so are the
+                     errors of the callback
+
+    Pending writes are flushed on close() and at interpreter exit.
+    """
+
+    def __init__(self, cls, max_batch=1000, max_delay=1, max_queue=10000,
+                 on_error=None):
+        self.cls = cls
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.on_error = on_error
+        # document key -> [[operation], [filter, update] of an update or
+        # [filter, update, True] of an upsert]
+        self.pending = OrderedDict()
+        self.count = 0
+        self.since = None
+        self.closed = False
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, doc):
+        doc._pre_save()
+        _id = doc._ensure_id()
+        doc._validate_for_write()
+        if _id is None:
+            self._put(self._key(None, doc), [doc._save_op()])
+            return
+        data = doc._data.copy()
+        del data['_id']
+        self._put(self._key(_id),
+                  [doc._target_filter(), {'$set': data}, True], replace=True)
+
+    def upsert(self, doc, null=False):
+        doc._pre_save()
+        doc._validate_for_write()
+        filter_ = doc._upsert_filter()
+        if not filter_:
+            self._put(self._key(None, doc), [doc._upsert_op(null)])
+            return
+        update = doc._upsert_update(filter_, null)
+        if update['$set']:
+            # same key as save() and update() when the _id is known
+            _id = filter_.get('_id', doc._data.get('_id'))
+            self._put(self._key(filter_ if _id is None else _id, doc),
+                      [filter_, update, True])
+
+    def update(self, doc_or_id, update):
+        """ update a Document, or the document of the given _id """
+        if hasattr(doc_or_id, '_target_filter'):
+            _id = doc_or_id._id
+            filter_ = doc_or_id._target_filter()
+        else:
+            _id = doc_or_id
+            filter_ = {'_id': _id}
+        self._put(self._key(_id), [filter_, update])
+
+    @staticmethod
+    def _key(value, doc=None):
+        if isinstance(value, dict):
+            value = tuple(sorted(value.items()))
+        try:
+            hash(value)
+        except TypeError:
+            value = None
+        if value is None or value == ():
+            # can't be coalesced
+            return ('doc', id(doc) if doc is not None else object())
+        return ('key', value)
+
+    def _put(self, key, entry, replace=False):
+        """ buffer a pending entry, see self.pending
+
+        :param replace: entry supersedes a previous upsert of the key
+        """
+        with self.cond:
+            if self.closed:
+                raise YamoException('writer of {} is closed'
+                                    ''.format(self.cls.__name__))
+            while self.count >= self.max_queue:
+                self.cond.wait()
+            entries = self.pending.setdefault(key, [])
+            last = entries[-1] if entries else None
+            if last is not None and len(last) == 3 and replace:
+                entries[-1] = entry
+                return
+            if last is not None and len(last) == len(entry) > 1:
+                merged = merge_updates(last[1], entry[1])
+                if merged is not None:
+                    last[1] = merged
+                    return
+            entries.append(entry)
+            self.count += 1
+            if self.since is None:
+                self.since = time.time()
+                self.cond.notify_all()
+            elif self.count >= self.max_batch:
+                self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (
+                        self.since is None or
+                        (self.count < self.max_batch and
+                         time.time() - self.since < self.max_delay)):
+                    timeout = None
+                    if self.since is not None:
+                        timeout = self.max_delay - (time.time() - self.since)
+                    self.cond.wait(timeout)
+                if self.closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # keep the thread, or callers block at max_queue forever
+                log.exception('write behind of {} failed'
+                              ''.format(self.cls.__name__))
+
+    def flush(self):
+        """ send all pending writes now """
+        with self.flush_lock:
+            with self.cond:
+                pending, self.pending = self.pending, OrderedDict()
+                self.count = 0
+                self.since = None
+                self.cond.notify_all()
+
+            # operations on one document must keep their order, so the
+            # n-th operation of every document goes in round n
+            rounds = []
+            for entries in pending.values():
+                for i, entry in enumerate(entries):
+                    if i == len(rounds):
+                        rounds.append([])
+                    if len(entry) > 1:
+                        entry = [operations.UpdateOne(*entry)]
+                    rounds[i].append(entry[0])
+            for ops in rounds:
+                for i in range(0, len(ops), self.max_batch):
+                    self._write(ops[i:i + self.max_batch])
+
+    def _write(self, ops):
+        try:
+            self.cls._coll.bulk_write(ops, ordered=False)
+        except Exception as e:
+            if self.on_error is not None:
+                try:
+                    self.on_error(e, ops)
+                except Exception:
+                    log.exception('on_error of the write behind of {} '
+                                  'failed'.format(self.cls.__name__))
+            else:
+                log.exception('write behind of {} failed'
+                              ''.format(self.cls.__name__))
+
+    def close(self):
+        """ stop the background thread and flush pending writes """
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.flush()
+        atexit.unregister(self.close)